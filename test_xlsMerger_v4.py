@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# ------------------------------------------------
+# regression tests for xlsMerger_v4 - needs arcpy, numpy and xlrd on the path
+# ------------------------------------------------
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import xlsMerger_v4 as merger
+except ImportError:
+    merger = None
+
+
+def setUpModule():
+    # the module logger is normally set up by init_logger_singleton when a merge starts
+    if merger is not None:
+        merger.logger = logging.getLogger('test_xlsMerger_v4')
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class HeaderFingerprintTest(unittest.TestCase):
+    def test_non_ascii_header(self):
+        fields = [{'name': u'Kilomètre', 'type': u'String', 'length': 255, 'alias': u'Kilomètre'}]
+        fingerprint = merger.headerFingerprint(fields)
+        self.assertEqual(len(fingerprint), 40)
+        self.assertEqual(fingerprint, merger.headerFingerprint(list(fields)))
+
+
+
+class FakeSheet(object):
+    def __init__(self, columns):
+        self.columns = columns
+        self.nrows = len(columns[0][1]) + 1
+        self.ncols = len(columns)
+
+    def col_types(self, column, start_row):
+        return self.columns[column][0]
+
+    def col_values(self, column, start_row):
+        return self.columns[column][1]
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class RowReaderTest(unittest.TestCase):
+    def test_1900_and_1904_workbooks_get_their_own_reader(self):
+        template = {'name': 'test', 'columns': {'Date Observed': 'Observation_Date'}, 'header_row': 0}
+        accepted = merger.returnAcceptedFieldList()
+        position = [field for field in accepted if field != 'OBJECTID'].index('Observation_Date')
+        sheet = FakeSheet([([merger.xlrd.XL_CELL_DATE], [40000.0])])
+        readers = {}
+        dates = []
+        for datemode in (0, 1):
+            reader = merger.returnRowReader(readers, template, ['Date Observed'], {}, accepted, datemode)
+            dates.append(list(reader(sheet))[0][position].date())
+        self.assertEqual(dates[0].isoformat(), '2009-07-06')
+        self.assertEqual(dates[1].isoformat(), '2013-07-07')
+        self.assertEqual(len(readers), 2)
+
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class WriteStageTest(unittest.TestCase):
+    def setUp(self):
+        self.commitBatches = merger.commitBatches
+        self.committed = []
+        merger.commitBatches = lambda variables, fields, batches, replace=False: self.committed.extend(batches)
+
+    def tearDown(self):
+        merger.commitBatches = self.commitBatches
+
+    def test_waiting_batches_are_dropped_when_the_run_stops(self):
+        def batches():
+            yield {'xlsx': 'a.xlsx', 'error': None, 'rows': [[1]]}
+            raise RuntimeError('stopped')
+
+        context = {'variables': {'write_batch_size': 100}, 'output_field_names': ['ID'], 'replace_rows': False}
+        with self.assertRaises(RuntimeError):
+            list(merger.writeStage(batches(), context))
+        self.assertEqual(self.committed, [])
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class RetryTest(unittest.TestCase):
+    def test_content_errors_are_not_retried(self):
+        self.assertTrue(merger.isEnvironmentError(IOError('the share went away')))
+        self.assertTrue(merger.isEnvironmentError(RuntimeError('Cannot acquire a lock.')))
+        self.assertFalse(merger.isEnvironmentError(merger.arcpy.ExecuteError('ERROR 000732: Sheet does not exist')))
+        self.assertFalse(merger.isEnvironmentError(RuntimeError('The value type is incompatible with the field type.')))
+
+    def test_retries_are_capped_by_content_hash(self):
+        context = {'quarantine': {}, 'retries': {}, 'manifest': {'files': {}}, 'report': {'workbooks': []},
+                   'variables': {'max_retries': 3}}
+        outcomes = []
+        for attempt in range(3):
+            batch = {'xlsx': 'a.xlsx', 'file_hash': 'abc', 'error': 'could not be written: locked', 'retry': True,
+                     'skipped': False, 'stats': {}}
+            merger.recordBatchOutcome(context, batch)
+            outcomes.append(batch['retry'])
+        self.assertEqual(outcomes, [True, True, False])
+        self.assertIn('abc', context['quarantine'])
+        self.assertEqual(context['retries'], {})
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class ExportSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_watch_reload_after_an_export_leaves_the_export_alone(self):
+        variables = {'export_sinks': ['csv'], 'export_folder': self.folder + os.sep, 'output_name': 'CCI',
+                     'write_batch_size': 10}
+        context = {'sinks': merger.openExportSinks(variables, ['ID', 'Comment'])}
+        list(merger.exportStage([{'error': None, 'rows': [[1, 'merged']]}], context))
+        merger.closeExportSinks(context)
+        path = os.path.join(self.folder, 'CCI.csv')
+        with open(path) as export:
+            merged = export.read()
+        # the export stage of a watch reload runs with the same context
+        list(merger.exportStage([{'error': None, 'rows': [[2, 'reloaded']]}], context))
+        with open(path) as export:
+            self.assertEqual(export.read(), merged)
+        self.assertEqual(context['sinks'], [])
+
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class PlanCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_watch_reloads_do_not_age_the_cache(self):
+        cache_file = os.path.join(self.folder, 'plan_cache.json')
+        plan_cache = merger.loadPlanCache(cache_file)
+        plan_cache['plans']['layout'] = {'plan': {}, 'last_run': plan_cache['run']}
+        merger.savePlanCache(cache_file, plan_cache, 10)
+        for event in range(20):
+            plan_cache = merger.loadPlanCache(cache_file, new_run=False)
+            merger.savePlanCache(cache_file, plan_cache, 10)
+        self.assertEqual(plan_cache['run'], 1)
+        self.assertIn('layout', plan_cache['plans'])
+
+
+@unittest.skipIf(merger is None, 'xlsMerger_v4 needs arcpy')
+class LoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for handler in logging.getLogger('mylogger').handlers[:]:
+            logging.getLogger('mylogger').removeHandler(handler)
+            handler.close()
+        merger.logger = logging.getLogger('test_xlsMerger_v4')
+        shutil.rmtree(self.folder)
+
+    def test_setting_up_twice_writes_each_line_once(self):
+        log_file = os.path.join(self.folder, 'merge.log')
+        merger.init_logger_singleton(log_file)
+        merger.init_logger_singleton(log_file)
+        merger.logger.warning('written once')
+        with open(log_file) as log:
+            self.assertEqual(log.read().count('written once'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
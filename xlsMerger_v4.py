@@ -25,7 +25,6 @@ TODO:
 - lock down spreadsheet so changes to schema aren't made. create domain set for at least Resolved field
 - add try:except for the whole script to record error if it occurs
 - make script grab files from the HUB and copy them to the workspace in folder
-- put all adjustable variables in a config function
 - clean up logger files are not in modules/functions
 - make functions/models more reuseable
 - can i use the return logger function instead of the global logger variable
@@ -38,21 +37,29 @@ TODO:
 # ------------------------------------------------
 print("importing modules...")
 
-import arcpy, logging, os, sys, datetime, re, shutil
+import arcpy, argparse, csv, io, logging, os, sys, datetime, re, shutil, json, hashlib, time, random, heapq, math, errno, socket, threading
+import numpy, xlrd
+from collections import deque
 from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 # ------------------------------------------------
 # setting up logger
 # ------------------------------------------------
-def init_logger_singleton():
+def init_logger_singleton(log_file):
     print("setting up logger...")
     global logger
 
     logging.basicConfig(level=logging.DEBUG)
     logger = logging.getLogger(name='mylogger')
 
+    # incrementalMerge calls this again through main, the log file is only given one handler
+    for handler in logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file):
+            return
+
     """create a file handler"""
-    handler = logging.FileHandler("//pipelinetrust.com.au/apps/GIS/Projects/CCI_Reporting/_py/runtime.log")
+    handler = logging.FileHandler(log_file)
     handler.setLevel(logging.DEBUG)
 
     """create a logging format"""
@@ -68,10 +75,13 @@ def init_logger_singleton():
 # ------------------------------------------------
 # setting up the environment and variables
 # ------------------------------------------------
-def environment():
+def environment(config):
 ##    arcpy.env.workspace = "//pipelinetrust.com.au/apps/GIS/Projects/CCI_Reporting/"
     arcpy.env.overwriteOutput = True
-    workspace = "//pipelinetrust.com.au/apps/GIS/Projects/CCI_Reporting/"
+    workspace = config['workspace']
+    # a scratch run keeps its own state files, the workspace already has its cache folder
+    if config['scratch_folder'] and not os.path.isdir(config['scratch_folder'] + config['cache_folder']):
+        os.makedirs(config['scratch_folder'] + config['cache_folder'])
     return workspace
 
 
@@ -94,551 +104,3764 @@ def renewFC(workspace, input):
         logger.info('File Geodatabase found. Deleting... ' + '\n')
         arcpy.Delete_management (input)
         logger.info('Creating a new geodatabase...' + '\n')
-        arcpy.CreateFileGDB_management (workspace, "data.gdb")
+        arcpy.CreateFileGDB_management (workspace, os.path.basename(input.rstrip('/')))
         logger.info('gdb created...' + '\n')
     else:
         logger.info('File geodatabase not found, creating a new one...' + '\n')
-        arcpy.CreateFileGDB_management (workspace, "data.gdb")
+        arcpy.CreateFileGDB_management (workspace, os.path.basename(input.rstrip('/')))
         logger.info('.gdb created...' + '\n')
 
 
 # ------------------------------------------------
 # create a feature table from all spreadsheets in a folder
 # ------------------------------------------------
-def excelToTable(workspace, output_gdb, output_temp, output, input_folder, start_xlsx):
+def excelToTable(input_folder, start_xlsx, context):
     # creates a list of all the xlsx file found in the folder
-    input_file_list = [f for f in os.listdir(input_folder) if os.path.isfile(os.path.join(input_folder, f)) and f.endswith('.xlsx')]
-    sheet="Operations"
-    # lists the current spreadsheet to be converted (eg. it is at number 15 of 118 spreadsheets to complete) 
-    count_xlsx = 1
+    input_file_list = listWorkbooks(input_folder)
     total_xlsx = len(input_file_list)
-    acceptedFieldList = returnAcceptedFieldList()
 
     logger.info('There are {0} excel spreadsheets to convert\n'.format(total_xlsx))
 
+    quarantined, skipped, retry = [], [], []
     # start script at file number that caused issue (input, start, end)
-    for xlsx in islice(input_file_list, start_xlsx, None):
-        logger.info('Converting number {0} of {1} spreadsheets to convert'.format(count_xlsx, total_xlsx))
-        logger.info('Spreadsheet name: %s ', input_file_list[start_xlsx])
-        arcpy.ExcelToTable_conversion (input_folder + xlsx, output_temp, sheet)
-        logger.info('completed conversion...')
-
-        ### adjust temp table's schema
-        logger.info('updating temp table schema...')
-        logger.info('adding new fields...')
-        addFields(output_temp)
-
-        ### list fields and their information
-        fieldInfo(output_temp)
-        
-        ### update field types in preparation for the append
-        fieldTypeConverter(output_temp)
-
-        # if any fields from the spreadsheet template are missing, add it to the temp table
-        # must be done after the excel to table conversion, otherwise fields will be added with no values
-        # and when the conversion trys to take place it sees the field and does not copy the values over
-        logger.info('checking for missing fields from the spreadsheet template that need to be added...')
-        fieldsToAdd(acceptedFieldList, output_temp)
-
-        logger.info('deleting original fields that cause issue with schema...')
-        fieldsToDelete(acceptedFieldList, output_temp)
-
-        # if CCI table does not exist, create it based off the temp folder
-        if not arcpy.Exists(output):
-            logger.info('creating CCI table...')
-            arcpy.CreateTable_management (output_gdb, 'CCI', output_temp)
-
-        # if the append fails, show what the differences are in the schema
-        try:    
-            logger.info('appending to output table... \n')
-            arcpy.Append_management (output_temp, output)
-            count_xlsx += 1
-            start_xlsx += 1
-        except:
-            logger.info('APPEND FAILED due to schema differences\nSCRIPT STOPPED')
-            compareTables(output, output_temp, workspace)
-            exit()
-
-        logger.info('deleting temp table... \n')
-        arcpy.Delete_management (in_data=output_temp)
-        logger.info('moving to next spreadsheet... \n')
+    for batch in runPipeline(islice(input_file_list, start_xlsx, None), context):
+        # a workbook that fails has none of its rows kept, it is quarantined or tried again next run and the
+        # run carries on
+        recordBatchOutcome(context, batch)
+        if batch['skipped']:
+            skipped.append(batch['xlsx'])
+        elif batch['retry']:
+            retry.append(batch['xlsx'])
+        elif batch['error'] is not None:
+            quarantined.append(batch['xlsx'])
+        start_xlsx += 1
+        logger.info('completed number {0} of {1} spreadsheets\n'.format(start_xlsx, total_xlsx))
 
+    logger.info('columns read by each path: %s', formatCounts(context['type_paths']))
+    if quarantined:
+        logger.info('%s spreadsheets were quarantined: %s', len(quarantined), ', '.join(quarantined))
+    if skipped:
+        logger.info('%s spreadsheets are still quarantined and were skipped: %s', len(skipped), ', '.join(skipped))
+    if retry:
+        logger.info('%s spreadsheets failed and will be tried again next run: %s', len(retry), ', '.join(retry))
 
-# -----------------------------------------
-# add fields and their properties to the designated fc using a dictionary and lists
-# -----------------------------------------
-def addFields(in_table):
-    logger.info("adding fields to " + in_table + '\n')
-    ### defining field, type, precision, scale, length and alias
-    DIC_field_names_type = {
-            2: ['Comments_Actions_Req', 'TEXT', '', '', '2000', 'Comments Actions Req']
-    }
 
-    """add fields to the feature class based off the values in dictionary"""
-    for key, value in DIC_field_names_type.iteritems():
-                    arcpy.AddField_management(in_table=in_table,
-                                              field_name=value[0],
-                                              field_type=value[1],
-                                              field_precision=value[2],
-                                              field_scale=value[3],
-                                              field_length=value[4],
-                                              field_alias=value[5])
+# ------------------------------------------------
+# lists the xlsx files in a folder, skipping the lock files excel creates while a file is open
+# ------------------------------------------------
+def listWorkbooks(input_folder):
+    return [f for f in os.listdir(input_folder) if os.path.isfile(os.path.join(input_folder, f))
+            and f.endswith('.xlsx') and not f.startswith('~$')]
 
 
 # ------------------------------------------------
-# display information about fields; names, types and lengths
+# everything worked out once per run and reused for every workbook; accepted fields, header
+# alias index, rules, templates, compiled row readers, the column plan cache and pipeline stages
 # ------------------------------------------------
-def fieldInfo(in_table):
-    logger.info("displaying field names and type:")
-    fields = arcpy.ListFields(in_table)
+def createMergeContext(plan_cache, variables):
+    acceptedFieldList = returnAcceptedFieldList()
+    context = {'acceptedFieldList': acceptedFieldList,
+               'output_field_names': returnOutputFields(acceptedFieldList),
+               'alias_index': buildAliasIndex(acceptedFieldList, returnHeaderSynonyms()),
+               'validationRules': returnValidationRules(),
+               # row readers are compiled once per template and header layout, then reused for every workbook
+               'templates': returnTemplates(),
+               'compiled_readers': {},
+               # workbooks read before are loaded from the workbook cache while this matches
+               'read_fingerprint': returnReadFingerprint(acceptedFieldList),
+               # number of columns read by each path; pass through, fast, coerce or empty
+               'type_paths': {},
+               'plan_cache': plan_cache,
+               # the workbooks rows have been loaded from by name, with their source file id, hash and modified time
+               'source_files': {},
+               # workbooks that failed by their content hash, skipped until their contents change
+               'quarantine': loadQuarantine(variables['quarantine_file']),
+               # the times workbooks that failed because of the share or the geodatabase were tried, by content hash
+               'retries': loadRetries(variables['retries_file']),
+               # the row count and checksum of every workbook in the output table, kept between runs
+               'manifest': loadManifest(variables['manifest_file'], acceptedFieldList),
+               # the outcome and counts of every workbook and the time spent in each stage, for the run report
+               'report': {'started': datetime.datetime.now(), 'workbooks': [], 'stage_seconds': {}},
+               'variables': variables,
+               # export files written alongside the output table, opened by a full merge
+               'sinks': [],
+               # fields of the output table, listed once it has been created
+               'output_fields': None,
+               # set when workbooks are loaded again; their old rows are deleted in the edit session their new
+               # rows are written in, so a workbook that fails keeps the rows it had
+               'replace_rows': False,
+               # the run lock while it is held, the read stage stops if another run takes it over
+               'lock': None,
+               'sheet': 'Operations',
+               'stages': returnPipelineStages()}
+    return context
 
-    for field in fields:
-        logger.info("%s is a type of %s with a length of %s"
-              ,field.name, field.type, field.length)
+
+# ------------------------------------------------
+# the fields written to the output table and feature class, in the order rows hold them; the accepted
+# fields, then the provenance fields, then the fields worked out from them such as Latitude
+# ------------------------------------------------
+def returnOutputFields(acceptedFields):
+    fieldNames = [field_name for field_name in acceptedFields if field_name != 'OBJECTID']
+    for role in ['provenance', 'derived']:
+        fieldNames += [value[0] for key, value in sorted(returnSchema().items()) if value[6] == role]
+    return fieldNames
 
 
 # ------------------------------------------------
-# used as the list of accepted fields for the table
+# the stages every batch of rows goes through after it is read, in order. each stage takes the batches
+# from the stage before it and yields them on, so extra steps can be plugged in by adding them here.
+# a batch holds the rows read from one workbook:
+#   xlsx        - the workbook the rows came from
+#   source_id   - the id of the workbook in the source files table, written to Source_File_ID
+#   source_file - the workbook's row for the source files table, written with the rows
+#   file_hash   - the sha1 of the workbook's contents, used to quarantine it
+#   fields      - the field names, the same order as the values in each row
+#   rows        - the rows, as lists
+#   row_numbers - the spreadsheet row number of each row, written to Source_Row
+#   rejects     - the rejects table rows for the rows that failed a rule, written with the rows
+#   error       - set when the workbook couldn't be read or written, later stages pass the batch on untouched
+#   retry       - set with the error when the share or the geodatabase failed rather than the workbook, it
+#                 is tried again on the next run instead of being quarantined, up to max_retries times
+#   skipped     - set when the workbook is quarantined and hasn't changed, it isn't read at all
+#   stats       - rows read and written, columns coerced, rows rejected, locations defaulted, left blank
+#                 or placed from KP, locations moved to the output coordinate system, points too far from
+#                 a pipeline and whether the rows came from the workbook cache
+#   checksum    - the row count and checksum of the rows written, set once they are saved
 # ------------------------------------------------
-def returnAcceptedFieldList():
-    # Latitude and longitude are deleted cause they will need to be re-created once in a table
-    acceptedFieldList = ['OBJECTID', 'Pipeline_Patrol_State', 'Sighting_Status', 'ID', 'Pipeline_Patrol_Program',
-                         'Submitted_By', 'Observation_Date', 'Sighting_Classification',
-                         'Comments_Actions_Req', 'Location', 'KP', 'Resolved', 'Resolved_Date', 'Resolved_By',
-                         'MP_for_RBP_only', 'APA_Encroachment_Number', 'Corridor_Inspection_Classification']
-    return acceptedFieldList
+def returnPipelineStages():
+    # locations are split and moved to the output coordinate system before the rules check them
+    stages = [latLongStage, coordinateStage, validateStage, centrelineStage, normaliseStage, writeStage,
+              exportStage]
+    return stages
 
 
 # ------------------------------------------------
-# deletes fields that are not defined in the list of accepted fields
+# runs workbooks through the read stage and every pipeline stage, returns the batches as they finish.
+# rows are only held in memory, the output table and feature class are written once at the end
 # ------------------------------------------------
-def fieldsToDelete(acceptedFields, in_table):
-    fields = arcpy.ListFields(in_table)
+def runPipeline(xlsx_list, context):
+    batches = timedStage(readStage, xlsx_list, context)
+    for stage in context['stages']:
+        batches = timedStage(stage, batches, context)
+    return batches
 
-    for field in fields:
-        if field.name not in acceptedFields:
-            arcpy.DeleteField_management (in_table=in_table,
-                                      drop_field=field.name)
-            logging.info('the %s field has been dropped', field.name)
+
+# ------------------------------------------------
+# runs a stage and adds the time spent in it to the run report. the stages are chained, so the time
+# spent waiting on the stage before is taken off to leave only the stage's own time
+# ------------------------------------------------
+def timedStage(stage, batches, context):
+    stage_seconds = context['report']['stage_seconds']
+    name = stage.__name__
+    upstream = [0.0]
+
+    def timedBatches():
+        iterator = iter(batches)
+        while True:
+            start = time.time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                upstream[0] += time.time() - start
+            yield batch
+
+    iterator = stage(timedBatches(), context)
+    while True:
+        start = time.time()
+        waited = upstream[0]
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stage_seconds[name] = stage_seconds.get(name, 0.0) + time.time() - start - (upstream[0] - waited)
+        yield batch
 
 
 # ------------------------------------------------
-# adds fields that are missing from the excel template spreadsheet
+# read stage; picks the template for each workbook and reads its rows with the compiled row reader,
+# which also matches the headers and converts the values. workbooks that no template matches go
+# through ExcelToTable and the column plans instead
 # ------------------------------------------------
-def fieldsToAdd(acceptedFields, in_table):
-    fieldList = arcpy.ListFields(in_table)
-    fieldNames = []
-    for field in fieldList:
-        fieldNames.append(field.name)
-    
-    for acceptedField in acceptedFields:
-        if acceptedField not in fieldNames:
-            # creating field as String. If type needs to be adjusted, this can be setup in the fieldTypeConverter
+def readStage(xlsx_list, context):
+    variables = context['variables']
+    fields = context['output_field_names']
+    for xlsx, contents, error in prefetchWorkbooks(xlsx_list, variables['input_folder'], variables['workers']):
+        checkRunLock(context, xlsx)
+        logger.info('Spreadsheet name: %s ', xlsx)
+        batch = {'xlsx': xlsx, 'source_id': None, 'source_file': None, 'file_hash': None, 'fields': fields,
+                 'rows': [], 'row_numbers': [], 'rejects': [], 'error': None, 'retry': False, 'skipped': False,
+                 'checksum': None, 'point_checksum': None,
+                 'stats': {'rows_read': 0, 'rows_written': 0, 'coerced': 0, 'rejected': 0, 'location_defaults': 0,
+                           'location_nulls': 0, 'location_imputed': 0, 'transformed': 0, 'off_centreline': 0,
+                           'cached': 0}}
+        try:
+            if error is not None:
+                raise error
+            batch['file_hash'] = hashlib.sha1(contents).hexdigest()
+            entry = context['quarantine'].get(batch['file_hash'])
+            if entry is not None:
+                # the lookup is on the contents, so a quarantined workbook saved again unchanged is still skipped
+                logger.info('%s has the same contents as %s when it was quarantined on %s, skipping...',
+                            xlsx, entry['xlsx'], entry['date'])
+                batch['error'] = 'quarantined: ' + entry['reason']
+                batch['skipped'] = True
+                yield batch
+                continue
+            batch['source_file'] = registerSourceFile(context, xlsx, batch['file_hash'])
+            batch['source_id'] = batch['source_file'][0]
+            if not loadCachedWorkbook(batch, context):
+                readWorkbook(batch, context, contents)
+                saveCachedWorkbook(batch, context)
+        except Exception as e:
+            # a workbook that can't be read is passed on with its error so the run carries on with the next one
+            batch['error'] = 'could not be read: {0}'.format(repr(e))
+            batch['retry'] = isEnvironmentError(e)
+            batch['rows'], batch['row_numbers'] = [], []
+        batch['stats']['rows_read'] = len(batch['rows'])
+        logger.info('%s rows read from %s', len(batch['rows']), xlsx)
+        yield batch
+
+
+# ------------------------------------------------
+# whether an error came from the share, the file system or the geodatabase rather than the contents of a
+# workbook. arcpy raises RuntimeError from its cursors and ExecuteError from its tools for both, such as
+# ExcelToTable on a workbook without the sheet, so those only count when the message is about a lock or
+# getting at a file
+# ------------------------------------------------
+def isEnvironmentError(e):
+    if isinstance(e, EnvironmentError):
+        return True
+    if isinstance(e, (RuntimeError, arcpy.ExecuteError)):
+        message = repr(e).lower()
+        return any(text in message for text in returnEnvironmentErrorText())
+    return False
+
+
+# ------------------------------------------------
+# text in the arcpy error messages that come from the share or the geodatabase rather than a workbook
+# ------------------------------------------------
+def returnEnvironmentErrorText():
+    return ['lock', 'access', 'denied', 'read only', 'sharing violation', 'network', 'workspace', 'disk', 'i/o']
+
+
+# ------------------------------------------------
+# reads the workbook files ahead of the read stage on worker threads, so waiting on the share overlaps
+# with reading the rows of the workbook before. no more than workers files are held at once. returns
+# the workbook name, its contents and the error if it couldn't be read
+# ------------------------------------------------
+def prefetchWorkbooks(xlsx_list, input_folder, workers):
+    def readFile(xlsx):
+        with open(input_folder + xlsx, 'rb') as f:
+            return f.read()
+
+    if workers <= 1:
+        for xlsx in xlsx_list:
+            try:
+                yield xlsx, readFile(xlsx), None
+            except (IOError, OSError) as e:
+                yield xlsx, None, e
+        return
+
+    pool = ThreadPool(workers)
+    pending = deque()
+    try:
+        for xlsx in xlsx_list:
+            pending.append((xlsx, pool.apply_async(readFile, (xlsx,))))
+            while len(pending) >= workers:
+                yield returnPrefetched(*pending.popleft())
+        while pending:
+            yield returnPrefetched(*pending.popleft())
+    finally:
+        pool.terminate()
+
+
+def returnPrefetched(xlsx, result):
+    try:
+        return xlsx, result.get(), None
+    except (IOError, OSError) as e:
+        return xlsx, None, e
+
+
+# ------------------------------------------------
+# reads the rows of one workbook into a batch, with the template row reader or through ExcelToTable
+# ------------------------------------------------
+def readWorkbook(batch, context, contents):
+    fields = batch['fields']
+    # read the header rows of the sheets to work out which template the workbook uses
+    book = xlrd.open_workbook(file_contents=contents, on_demand=True)
+    try:
+        match = sniffTemplate(book, context['templates'], context['alias_index'])
+        if match is None:
+            logger.info('no template matched, converting the %s sheet and negotiating its schema...',
+                        context['sheet'])
+            readTempTable(batch, context)
+        else:
+            template, sheet_name, headers = match
+            logger.info('using the %s template, reading the %s sheet...', template['name'], sheet_name)
+            reader = returnRowReader(context['compiled_readers'], template, headers, context['alias_index'],
+                                     context['acceptedFieldList'], book.datemode)
+            # the row reader fills the accepted fields, the fields after them are filled by later stages
+            padding = [None] * (len(fields) - len(context['acceptedFieldList']) + 1)
+            first_row = template['header_row'] + 2
+            path_counts = {}
+            for i, row in enumerate(reader(book.sheet_by_name(sheet_name), path_counts)):
+                batch['rows'].append(row + padding)
+                batch['row_numbers'].append(first_row + i)
+            batch['stats']['coerced'] = path_counts.get('coerce', 0)
+            for path, count in path_counts.items():
+                context['type_paths'][path] = context['type_paths'].get(path, 0) + count
+    finally:
+        book.release_resources()
+
+
+# ------------------------------------------------
+# a fingerprint of everything that decides the values read from a workbook; the accepted fields with their
+# types and lengths, header synonyms, templates and date handling. the rules and later stages aren't part
+# of it, so changing them still uses the workbook cache
+# ------------------------------------------------
+def returnReadFingerprint(acceptedFieldList):
+    settings = [[[field_name, returnFieldDefinition(field_name)] for field_name in acceptedFieldList],
+                sorted(returnHeaderSynonyms().items()), returnTemplates(), returnDateFormats(),
+                [date.isoformat() for date in returnDateSentinels()]]
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# ------------------------------------------------
+# the workbook cache; the accepted field columns of each workbook read, saved as a compressed npz file
+# named after the workbook's content hash and the read fingerprint. text is stored as utf-8 bytes with
+# offsets, dates as microseconds and every column has a mask of its blank values, so nothing is pickled
+# ------------------------------------------------
+def workbookCachePath(batch, context):
+    return '{0}{1}_{2}.npz'.format(context['variables']['workbook_cache_folder'], batch['file_hash'],
+                                   context['read_fingerprint'][:12])
+
+
+def encodeColumn(values, field_type):
+    blank = numpy.array([value is None for value in values], dtype=bool)
+    if field_type == 'Date':
+        epoch = datetime.datetime(1970, 1, 1)
+        deltas = [value - epoch if value is not None else datetime.timedelta(0) for value in values]
+        return blank, [numpy.array([(delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+                                    for delta in deltas], dtype=numpy.int64)]
+    elif field_type == 'Long' or field_type == 'Short':
+        return blank, [numpy.array([value if value is not None else 0 for value in values], dtype=numpy.int64)]
+    elif field_type == 'Double':
+        return blank, [numpy.array([value if value is not None else 0.0 for value in values], dtype=numpy.float64)]
+    encoded = [u'{0}'.format(value).encode('utf-8') if value is not None else b'' for value in values]
+    offsets = numpy.cumsum([0] + [len(value) for value in encoded]).astype(numpy.int64)
+    return blank, [numpy.frombuffer(b''.join(encoded) or b'\0', dtype=numpy.uint8), offsets]
+
+
+def decodeColumn(blank, arrays, field_type):
+    if field_type == 'Date':
+        epoch = datetime.datetime(1970, 1, 1)
+        values = [epoch + datetime.timedelta(microseconds=int(value)) for value in arrays[0]]
+    elif field_type == 'Long' or field_type == 'Short' or field_type == 'Double':
+        values = arrays[0].tolist()
+    else:
+        data = arrays[0].tobytes() if hasattr(arrays[0], 'tobytes') else arrays[0].tostring()
+        offsets = arrays[1].tolist()
+        values = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+    return [None if is_blank else value for value, is_blank in zip(values, blank.tolist())]
+
+
+# ------------------------------------------------
+# fills a batch from the workbook cache, returns False when the workbook isn't in the cache
+# ------------------------------------------------
+def loadCachedWorkbook(batch, context):
+    path = workbookCachePath(batch, context)
+    if context['variables']['workbook_cache_bytes'] <= 0 or not os.path.isfile(path):
+        return False
+    fields = [field_name for field_name in context['acceptedFieldList'] if field_name != 'OBJECTID']
+    try:
+        with open(path, 'rb') as f:
+            cached = numpy.load(f)
+            columns = []
+            for i, field_name in enumerate(fields):
+                arrays = [cached['c{0}_{1}'.format(i, part)] for part in range(int(cached['parts'][i]))]
+                columns.append(decodeColumn(cached['b{0}'.format(i)], arrays, returnFieldTargetType(field_name)))
+            row_numbers = cached['row_numbers'].tolist()
+            coerced = int(cached['coerced'])
+    except (IOError, OSError, KeyError, ValueError) as e:
+        logger.info('cached copy of %s could not be read, reading the workbook: %s', batch['xlsx'], repr(e))
+        return False
+    # the file's time marks when it was last used, so the least recently used workbooks are removed first
+    os.utime(path, None)
+    padding = [None] * (len(batch['fields']) - len(fields))
+    batch['rows'] = [list(row) + padding for row in zip(*columns)] if fields else []
+    batch['row_numbers'] = row_numbers
+    batch['stats']['coerced'] = coerced
+    batch['stats']['cached'] = 1
+    logger.info('%s read from the workbook cache', batch['xlsx'])
+    return True
+
+
+# ------------------------------------------------
+# saves the accepted field columns of a batch just read to the workbook cache, then removes the least
+# recently used workbooks until the cache is under workbook_cache_bytes
+# ------------------------------------------------
+def saveCachedWorkbook(batch, context):
+    variables = context['variables']
+    if variables['workbook_cache_bytes'] <= 0 or batch['error'] is not None:
+        return
+    fields = [field_name for field_name in context['acceptedFieldList'] if field_name != 'OBJECTID']
+    arrays = {'row_numbers': numpy.array(batch['row_numbers'], dtype=numpy.int64),
+              'coerced': numpy.array(batch['stats']['coerced'])}
+    parts = []
+    try:
+        for i, field_name in enumerate(fields):
+            blank, column_arrays = encodeColumn([row[i] for row in batch['rows']], returnFieldTargetType(field_name))
+            arrays['b{0}'.format(i)] = blank
+            for part, array in enumerate(column_arrays):
+                arrays['c{0}_{1}'.format(i, part)] = array
+            parts.append(len(column_arrays))
+    except (TypeError, ValueError, AttributeError) as e:
+        # a value that isn't the type of its field is left for the next run to read again
+        logger.info('%s is not cached, a value is not the type of its field: %s', batch['xlsx'], repr(e))
+        return
+    arrays['parts'] = numpy.array(parts, dtype=numpy.int64)
+
+    if not os.path.isdir(variables['workbook_cache_folder']):
+        os.makedirs(variables['workbook_cache_folder'])
+    path = workbookCachePath(batch, context)
+    with open(path + '.tmp', 'wb') as f:
+        numpy.savez_compressed(f, **arrays)
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(path + '.tmp', path)
+    evictWorkbookCache(variables['workbook_cache_folder'], variables['workbook_cache_bytes'])
+
+
+def evictWorkbookCache(cache_folder, max_bytes):
+    files = []
+    for file_name in os.listdir(cache_folder):
+        if file_name.endswith('.npz'):
+            stat = os.stat(cache_folder + file_name)
+            files.append([stat.st_mtime, stat.st_size, file_name])
+    total = sum(size for used, size, file_name in files)
+    for used, size, file_name in sorted(files):
+        if total <= max_bytes:
+            break
+        logger.info('removing %s from the workbook cache, it is over %s bytes', file_name, max_bytes)
+        os.remove(cache_folder + file_name)
+        total -= size
+
+
+# ------------------------------------------------
+# reads a workbook through ExcelToTable and the column plans into a batch. the temp table's schema is
+# checked against the output table first, so a workbook that can't be matched is stopped here
+# ------------------------------------------------
+def readTempTable(batch, context):
+    variables = context['variables']
+    output_temp = variables['output_temp_table']
+    try:
+        plan = excelToTempTable(variables['input_folder'] + batch['xlsx'], output_temp, context['sheet'],
+                                context['plan_cache'], context['acceptedFieldList'], context['alias_index'])
+        batch['stats']['coerced'] = len(plan['coerce'])
+
+        # fields only in the output table, such as Latitude, are filled by later stages so only the
+        # fields in both tables are compared. rows are copied by cursor so the aliases don't matter
+        compare_file = variables['cache_folder'] + 'schema_issues.json'
+        if compareTables(context['output_fields'], fieldDescriptors(output_temp), compare_file, batch['xlsx'],
+                         ignore_missing=True, check_alias=False):
+            batch['error'] = 'schema differences, see ' + compare_file
+            return
+
+        fields = [field_name for field_name in context['acceptedFieldList'] if field_name != 'OBJECTID']
+        padding = [None] * (len(batch['fields']) - len(fields))
+        with arcpy.da.SearchCursor(output_temp, ['OID@'] + fields) as cursor:
+            for row in cursor:
+                batch['rows'].append(list(row[1:]) + padding)
+                # the spreadsheet row is one after the object id because of the header row
+                batch['row_numbers'].append(row[0] + 1)
+    finally:
+        # the temp table is removed whether or not the workbook could be read, so it isn't left behind
+        if arcpy.Exists(output_temp):
+            logger.info('deleting temp table... \n')
+            arcpy.Delete_management (in_data=output_temp)
+
+
+# ------------------------------------------------
+# validate stage; rows that fail a validation rule are dropped and kept for the rejects table
+# ------------------------------------------------
+def validateStage(batches, context):
+    for batch in batches:
+        if batch['error'] is None and batch['rows']:
+            logger.info('validating rows, rows that fail are moved to the rejects table...')
+            batch['stats']['rejected'] = rejectRows(batch, context['validationRules'])
+        yield batch
+
+
+# ------------------------------------------------
+# normalise stage; if any other value other than yes, return no in the Resolved field, and tag
+# rows with the workbook and spreadsheet row they came from
+# ------------------------------------------------
+def normaliseStage(batches, context):
+    for batch in batches:
+        resolved = batch['fields'].index('Resolved')
+        source_file = batch['fields'].index('Source_File_ID')
+        source_row = batch['fields'].index('Source_Row')
+        for row, row_number in zip(batch['rows'], batch['row_numbers']):
+            if row[resolved] != 'Yes':
+                row[resolved] = 'No'
+            row[source_file] = batch['source_id']
+            row[source_row] = row_number
+        yield batch
+
+
+# ------------------------------------------------
+# lat/long stage; splits the location field into latitude and longitude. locations that can't be read
+# get the default location, or with location_fallback set to null or kp keep the value they had and
+# are left without a point. the centreline stage places the kp ones from their KP where it can
+# ------------------------------------------------
+def latLongStage(batches, context):
+    default_location = context['variables']['default_location']
+    default_point = [float(part) for part in default_location.split(',')]
+    fallback = context['variables']['location_fallback']
+    for batch in batches:
+        location = batch['fields'].index('Location')
+        latitude = batch['fields'].index('Latitude')
+        longitude = batch['fields'].index('Longitude')
+        unread = []
+        for row, point in zip(batch['rows'], parseLocations([row[location] for row in batch['rows']])):
+            if point is not None:
+                row[latitude], row[longitude] = point
+                continue
+            if row[location] is not None and row[location].strip():
+                unread.append(row[location])
+            if fallback == 'default':
+                row[location] = default_location
+                row[latitude], row[longitude] = default_point
+                batch['stats']['location_defaults'] += 1
+            else:
+                row[latitude], row[longitude] = None, None
+                batch['stats']['location_nulls'] += 1
+        if unread:
+            logger.info('%s locations in %s could not be read, such as: %s', len(unread), batch['xlsx'],
+                        ' | '.join(unread[:5]))
+        yield batch
+
+
+# ------------------------------------------------
+# coordinate stage; works out whether each location is a latitude/longitude or an MGA easting/northing
+# and moves it into the coordinate system of the feature class, a whole workbook at a time
+# ------------------------------------------------
+def coordinateStage(batches, context):
+    for batch in batches:
+        if batch['error'] is None and batch['rows']:
+            batch['stats']['transformed'] = transformLocations(batch, context)
+        yield batch
+
+
+# ------------------------------------------------
+# centreline stage; places rows without a location from their KP when location_fallback is kp, then
+# snaps each point to the nearest pipeline centreline and works out its KP along the pipeline and
+# distance from it. the centrelines are only loaded the first time
+# ------------------------------------------------
+def centrelineStage(batches, context):
+    variables = context['variables']
+    for batch in batches:
+        if batch['error'] is None and batch['rows'] and variables['centreline_fc']:
+            if 'centreline_index' not in context:
+                lines = loadCentrelines(variables)
+                context['centreline_index'] = buildCentrelineIndex(lines)
+                context['kp_index'] = buildKpIndex(lines)
+            if variables['location_fallback'] == 'kp':
+                imputed = imputeLocations(batch, context['kp_index'], variables['kp_pipeline_field'])
+                # the rows placed were counted as left blank by the lat/long stage
+                batch['stats']['location_imputed'] += imputed
+                batch['stats']['location_nulls'] -= imputed
+            batch['stats']['off_centreline'] = snapLocations(batch, context['centreline_index'],
+                                                             variables['default_location'],
+                                                             variables['centreline_max_offset'])
+        yield batch
+
+
+# ------------------------------------------------
+# write stage; inserts the rows into the output table and their points into the feature class. whole
+# workbooks are collected until they hold at least write_batch_size rows and written in one edit session,
+# so a workbook is never split between edit sessions. batches are passed on once their rows are saved
+# ------------------------------------------------
+def writeStage(batches, context):
+    variables = context['variables']
+    fields = context['output_field_names']
+    batch_size = variables['write_batch_size']
+    replace = context['replace_rows']
+    waiting = []
+    try:
+        for batch in batches:
+            if batch['error'] is not None:
+                yield batch
+                continue
+            waiting.append(batch)
+            if sum(len(waiting_batch['rows']) for waiting_batch in waiting) >= batch_size:
+                checkRunLock(context, 'writing')
+                committed, waiting = waiting, []
+                for committed_batch in commitBatches(variables, fields, committed, replace):
+                    yield committed_batch
+        checkRunLock(context, 'writing')
+        committed, waiting = waiting, []
+        for committed_batch in commitBatches(variables, fields, committed, replace):
+            yield committed_batch
+    finally:
+        # when the run is stopped part way the workbooks still waiting are not written. they never reach the
+        # manifest, so like the workbooks not read yet they are loaded by the next run
+        if waiting:
+            logger.info('the run stopped, %s workbooks waiting to be written were left out: %s', len(waiting),
+                        ', '.join(batch['xlsx'] for batch in waiting))
+
+
+# ------------------------------------------------
+# export stage; writes the rows saved to the output table to each export file too, so the exports come
+# from the same read of the spreadsheets and leave out the same rolled back workbooks
+# ------------------------------------------------
+def exportStage(batches, context):
+    for batch in batches:
+        if batch['error'] is None and batch['rows']:
+            for sink in context['sinks']:
+                sink['write'](batch['rows'])
+        yield batch
+
+
+# ------------------------------------------------
+# opens an export file for each of the export_sinks; csv, geojson or parquet. the files are written under
+# a temporary name and only put in place once the merge has finished. parquet needs pyarrow, when it isn't installed
+# that export is left out
+# ------------------------------------------------
+def openExportSinks(variables, fields):
+    sinks = []
+    if not variables['export_sinks']:
+        return sinks
+    if not os.path.isdir(variables['export_folder']):
+        os.makedirs(variables['export_folder'])
+    for sink_type in variables['export_sinks']:
+        path = variables['export_folder'] + variables['output_name'] + '.' + sink_type
+        try:
+            if sink_type == 'csv':
+                sink = openCsvSink(path + '.tmp', fields)
+            elif sink_type == 'geojson':
+                sink = openGeoJsonSink(path + '.tmp', fields)
+            else:
+                sink = openParquetSink(path + '.tmp', fields, variables['write_batch_size'])
+        except ImportError as e:
+            logger.info('the %s export can not be written and is left out: %s', sink_type, e)
+            continue
+        sink['path'] = path
+        sinks.append(sink)
+        logger.info('writing a %s export to %s', sink_type, path)
+    return sinks
+
+
+# ------------------------------------------------
+# closes the export files and puts them in place of the last ones. with publish off, after a merge that
+# failed, the temporary files are deleted and the last exports are left as they were. the sinks are taken off
+# the context, the exports are of the full merge so the reloads of watch mode don't write to them
+# ------------------------------------------------
+def closeExportSinks(context, publish=True):
+    sinks, context['sinks'] = context['sinks'], []
+    for sink in sinks:
+        sink['close']()
+        if not publish:
+            os.remove(sink['path'] + '.tmp')
+            logger.info('the merge failed, %s was left as it was', sink['path'])
+            continue
+        if os.path.isfile(sink['path']):
+            os.remove(sink['path'])
+        os.rename(sink['path'] + '.tmp', sink['path'])
+
+
+# ------------------------------------------------
+# turns a value into text for the csv and geojson exports
+# ------------------------------------------------
+def exportValue(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def openCsvSink(path, fields):
+    # the python 2 csv module only writes bytes, so values are encoded first there
+    if sys.version_info[0] < 3:
+        f = open(path, 'wb')
+        encode = lambda value: value.encode('utf-8') if isinstance(value, type(u'')) else value
+    else:
+        f = io.open(path, 'w', newline='', encoding='utf-8')
+        encode = lambda value: value
+    writer = csv.writer(f)
+    writer.writerow([encode(field_name) for field_name in fields])
+
+    def write(rows):
+        writer.writerows([encode(exportValue(value)) for value in row] for row in rows)
+
+    return {'write': write, 'close': f.close}
+
+
+def openGeoJsonSink(path, fields):
+    latitude = fields.index('Latitude')
+    longitude = fields.index('Longitude')
+    f = open(path, 'wb')
+    f.write(b'{"type": "FeatureCollection", "features": [\n')
+    written = [0]
+
+    def write(rows):
+        for row in rows:
+            point = None
+            if row[latitude] is not None and row[longitude] is not None:
+                point = {'type': 'Point', 'coordinates': [row[longitude], row[latitude]]}
+            feature = {'type': 'Feature',
+                       'geometry': point,
+                       'properties': dict(zip(fields, [exportValue(value) for value in row]))}
+            f.write((b',\n' if written[0] else b'') + json.dumps(feature, sort_keys=True).encode('utf-8'))
+            written[0] += 1
+
+    def close():
+        f.write(b'\n]}\n')
+        f.close()
+
+    return {'write': write, 'close': close}
+
+
+def openParquetSink(path, fields, row_group_size):
+    import pyarrow, pyarrow.parquet
+    arrow_types = {'String': pyarrow.string(), 'Long': pyarrow.int64(), 'Short': pyarrow.int16(),
+                   'Double': pyarrow.float64(), 'Date': pyarrow.timestamp('us')}
+    types = [arrow_types[returnFieldDefinition(field_name)[0]] for field_name in fields]
+    schema = pyarrow.schema([pyarrow.field(field_name, field_type) for field_name, field_type in zip(fields, types)])
+    writer = pyarrow.parquet.ParquetWriter(path, schema, compression='snappy')
+    # rows are held until there are enough for a row group, workbooks are often only a few hundred rows
+    pending = []
+
+    def flush():
+        columns = list(zip(*pending)) if pending else [[] for field_name in fields]
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(list(column), type=field_type) for column, field_type in zip(columns, types)],
+            schema=schema))
+        del pending[:]
+
+    def write(rows):
+        pending.extend(rows)
+        if len(pending) >= row_group_size:
+            flush()
+
+    def close():
+        if pending:
+            flush()
+        writer.close()
+
+    return {'write': write, 'close': close}
+
+
+# ------------------------------------------------
+# writes the rows and rejects of whole workbooks in one edit session. if it fails nothing is saved, so each
+# workbook is written again in its own edit session and only the workbooks that fail on their own are left
+# out. with replace set the rows the workbooks had are deleted in the same edit session. returns the
+# batches, with the error set on the ones that couldn't be written
+# ------------------------------------------------
+def commitBatches(variables, fields, batches, replace=False):
+    if not batches:
+        return batches
+    try:
+        writeRows(variables, fields, [row for batch in batches for row in batch['rows']],
+                  [reject for batch in batches for reject in batch['rejects']],
+                  [batch['source_id'] for batch in batches] if replace else [],
+                  [batch['source_file'] for batch in batches if batch['source_file'] is not None])
+        latitude = fields.index('Latitude')
+        longitude = fields.index('Longitude')
+        for batch in batches:
+            batch['stats']['rows_written'] = len(batch['rows'])
+            batch['checksum'] = checksumRows(batch['rows'])
+            batch['point_checksum'] = checksumRows([row for row in batch['rows']
+                                                    if row[latitude] is not None and row[longitude] is not None])
+        return batches
+    except Exception as e:
+        if len(batches) == 1:
+            batch = batches[0]
+            batch['error'] = 'could not be written: {0}'.format(repr(e))
+            # a lock or the share is tried again, a value the geodatabase won't take is the workbook's
+            batch['retry'] = isEnvironmentError(e)
+            return batches
+    logger.info('writing %s workbooks together failed, writing them one at a time...', len(batches))
+    for batch in batches:
+        commitBatches(variables, fields, [batch], replace)
+    return batches
+
+
+# ------------------------------------------------
+# writes rows to the output table, their points to the feature class and the rejects to the rejects table
+# in one edit session, so the lot is saved together or not at all. rows without a location are only
+# written to the table. the rows of replace_ids are deleted from all three first. source_files are the
+# rows of the workbooks for the source files table, they replace the rows there with the same id
+# ------------------------------------------------
+def writeRows(variables, fields, rows, rejects=(), replace_ids=(), source_files=()):
+    latitude = fields.index('Latitude')
+    longitude = fields.index('Longitude')
+    edit = arcpy.da.Editor(variables['output_gdb'].rstrip('/'))
+    edit.startEditing(False, False)
+    edit.startOperation()
+    try:
+        for in_table in [variables['output_table'], variables['output_fc'], variables['rejects_table']]:
+            deleteSourceRows(in_table, replace_ids)
+        with arcpy.da.InsertCursor(variables['output_table'], fields) as table_cursor:
+            with arcpy.da.InsertCursor(variables['output_fc'], fields + ['SHAPE@XY']) as fc_cursor:
+                for row in rows:
+                    table_cursor.insertRow(row)
+                    if row[latitude] is not None and row[longitude] is not None:
+                        fc_cursor.insertRow(row + [(row[longitude], row[latitude])])
+        if rejects:
+            with arcpy.da.InsertCursor(variables['rejects_table'], ['Source_File_ID', 'Source_Row', 'Rule',
+                                                                    'Field_Name', 'Field_Value']) as cursor:
+                for reject in rejects:
+                    cursor.insertRow(reject)
+        if source_files:
+            source_fields = [value[0] for key, value in sorted(returnSourceFileFields().items())]
+            deleteSourceRows(variables['source_files_table'], [source_file[0] for source_file in source_files])
+            with arcpy.da.InsertCursor(variables['source_files_table'], source_fields) as cursor:
+                for source_file in source_files:
+                    cursor.insertRow(source_file)
+    except:
+        edit.abortOperation()
+        edit.stopEditing(False)
+        raise
+    edit.stopOperation()
+    edit.stopEditing(True)
+    logger.debug('%s rows written', len(rows))
+
+
+# ------------------------------------------------
+# turns a value into the text it is hashed as, so a value hashes the same read from the pipeline or
+# back out of the output table. dates are to the second, the geodatabase doesn't keep fractions of one
+# ------------------------------------------------
+def canonicalValue(value):
+    if value is None:
+        return u''
+    elif isinstance(value, datetime.datetime):
+        return value.replace(microsecond=0).isoformat(' ')
+    elif isinstance(value, float):
+        return repr(value)
+    return u'{0}'.format(value)
+
+
+# ------------------------------------------------
+# the row count and checksum of some rows. each row is hashed and the hashes are added up, so the
+# checksum doesn't depend on the order the rows are in and a repeated row still counts
+# ------------------------------------------------
+def checksumRows(rows):
+    total = 0
+    count = 0
+    for row in rows:
+        text = u'\x1f'.join(canonicalValue(value) for value in row)
+        total += int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:16], 16)
+        count += 1
+    return [count, total & 0xFFFFFFFFFFFFFFFF]
+
+
+# ------------------------------------------------
+# adds checksums together, the checksum of all their rows
+# ------------------------------------------------
+def combineChecksums(checksums):
+    count = sum(checksum[0] for checksum in checksums)
+    total = sum(checksum[1] for checksum in checksums)
+    return [count, total & 0xFFFFFFFFFFFFFFFF]
+
+
+# ------------------------------------------------
+# makes made up rows in the output field order for benchmarking
+# ------------------------------------------------
+def syntheticRows(fieldNames, count):
+    rng = random.Random(count)
+    start = datetime.datetime(2015, 1, 1)
+    rows = []
+    for i in range(count):
+        observed = start + datetime.timedelta(days=rng.randint(0, 1500))
+        latitude = round(rng.uniform(-38.0, -12.0), 6)
+        longitude = round(rng.uniform(115.0, 153.0), 6)
+        values = {'ID': i, 'KP': round(rng.uniform(0, 1000), 3), 'Observation_Date': observed,
+                  'Resolved_Date': observed + datetime.timedelta(days=rng.randint(0, 60)),
+                  'Resolved': rng.choice(['Yes', 'No']), 'Location': '{0},{1}'.format(latitude, longitude),
+                  'Latitude': latitude, 'Longitude': longitude, 'Source_File_ID': 1, 'Source_Row': i + 2,
+                  'Comments_Actions_Req': 'synthetic comment ' * rng.randint(1, 10)}
+        # text fields without a made up value get a placeholder, other fields are left blank
+        rows.append([values.get(field_name, 'synthetic' if returnFieldTargetType(field_name) in (None, 'String')
+                                else None) for field_name in fieldNames])
+    return rows
+
+
+# ------------------------------------------------
+# made up location values in the ways they turn up in the spreadsheets, mostly decimal pairs
+# ------------------------------------------------
+def syntheticLocations(count, decimal_only=False):
+    rng = random.Random(count)
+    locations = []
+    for i in range(count):
+        latitude, longitude = rng.uniform(-38.0, -12.0), rng.uniform(115.0, 153.0)
+        form = 0 if decimal_only else rng.randint(0, 19)
+        if form == 16:
+            locations.append(u'{0:.6f} , {1:.6f}'.format(longitude, latitude))
+        elif form == 17:
+            locations.append(u'lat {0:.5f} long {1:.5f}'.format(latitude, longitude))
+        elif form == 18:
+            locations.append(u'{0}\u00b0{1:02d}\'{2:02d}"S {3}\u00b0{4:02d}\'{5:02d}"E'.format(
+                int(-latitude), int(-latitude * 60) % 60, int(-latitude * 3600) % 60,
+                int(longitude), int(longitude * 60) % 60, int(longitude * 3600) % 60))
+        elif form == 19:
+            locations.append(u'{0}\u00b0{1:.3f}\'S {2}\u00b0{3:.3f}\'E'.format(
+                int(-latitude), (-latitude * 60) % 60, int(longitude), (longitude * 60) % 60))
+        else:
+            locations.append(u'{0:.6f},{1:.6f}'.format(latitude, longitude))
+    return locations
+
+
+# ------------------------------------------------
+# times parseLocations over made up locations, decimal pairs on their own and then mixed with the other
+# forms. returns the strings per second of each
+# ------------------------------------------------
+def benchmarkLocationParser(count):
+    rates = []
+    for name, locations in [['decimal', syntheticLocations(count, decimal_only=True)],
+                            ['mixed', syntheticLocations(count)]]:
+        started = time.time()
+        points = parseLocations(locations)
+        seconds = time.time() - started
+        rates.append(count / seconds if seconds else 0)
+        logger.info('%s locations: %s parsed in %.2f seconds, %.0f strings/sec, %s not read', name, count, seconds,
+                    rates[-1], points.count(None))
+    return rates
+
+
+# ------------------------------------------------
+# times writeRows with each of the batch sizes against a scratch geodatabase, returns the fastest size
+# ------------------------------------------------
+def benchmarkBatchSizes(variables, fieldNames, batch_sizes, row_count):
+    bench_folder = variables['cache_folder']
+    bench_gdb = bench_folder + 'bench.gdb/'
+    if arcpy.Exists(bench_gdb):
+        arcpy.Delete_management (bench_gdb)
+    arcpy.CreateFileGDB_management (bench_folder, 'bench.gdb')
+    bench_variables = dict(variables, output_gdb=bench_gdb, output_table=bench_gdb + 'CCI',
+                           output_fc=bench_gdb + variables['output_name'])
+    createOutputTables(bench_variables, fieldNames)
+    rows = syntheticRows(fieldNames, row_count)
+
+    results = []
+    for batch_size in batch_sizes:
+        arcpy.TruncateTable_management (bench_variables['output_table'])
+        arcpy.TruncateTable_management (bench_variables['output_fc'])
+        started = time.time()
+        for i in range(0, row_count, batch_size):
+            writeRows(bench_variables, fieldNames, rows[i:i + batch_size])
+        seconds = time.time() - started
+        results.append([batch_size, seconds])
+        logger.info('batch size %s: %s rows in %.2f seconds, %.0f rows/sec', batch_size, row_count, seconds,
+                    row_count / seconds if seconds else 0)
+    arcpy.Delete_management (bench_gdb)
+    best = min(results, key=lambda result: result[1])[0]
+    logger.info('fastest batch size: %s', best)
+    return best
+
+
+# ------------------------------------------------
+# creates the empty output table and point feature class with every output field from returnSchema,
+# so nothing has to be added to them once they hold data
+# ------------------------------------------------
+def createOutputTables(variables, fieldNames):
+    output_gdb = variables['output_gdb']
+    # the default of 4283 is the code for:
+    #  GCS_GDA_1994 (Meters)
+    coordinate_system = arcpy.SpatialReference(variables['spatial_reference'])
+    arcpy.CreateTable_management (output_gdb, os.path.basename(variables['output_table']))
+    arcpy.CreateFeatureclass_management (output_gdb, variables['output_name'], 'POINT',
+                                         spatial_reference=coordinate_system)
+    for in_table in [variables['output_table'], variables['output_fc']]:
+        for field_name in fieldNames:
+            value = returnFieldDefinition(field_name)
             arcpy.AddField_management(in_table=in_table,
-                                              field_name=acceptedField,
-                                              field_type='TEXT',
-                                              field_precision='',
-                                              field_scale='',
-                                              field_length='255',
-                                              field_alias='')           
+                                      field_name=field_name,
+                                      field_type=value[0],
+                                      field_precision=value[1],
+                                      field_scale=value[2],
+                                      field_length=value[3],
+                                      field_alias=value[4])
 
 
 # ------------------------------------------------
-# compare the schemas of the input and output table
+# creates the lookup table of the workbooks rows were loaded from. each row of the output table only holds
+# the small source file id and its spreadsheet row, the path, hash and modified time of the workbook are here
 # ------------------------------------------------
-def compareTables(base_table, test_table, workspace):
-    # Set local variables
-    sort_field = "OBJECTID"
-    compare_type = "SCHEMA_ONLY"
-    ignore_option = ""
-    attribute_tolerance = ""
-    omit_field = ""
-    continue_compare = "CONTINUE_COMPARE"
-    compare_file = workspace + "_py/schema_issues.txt"
+def createSourceFilesTable(output_gdb, table_name):
+    arcpy.CreateTable_management (output_gdb, table_name)
+    DIC_field_names_type = returnSourceFileFields()
+    for key, value in sorted(DIC_field_names_type.items()):
+        arcpy.AddField_management(in_table=output_gdb + table_name,
+                                  field_name=value[0],
+                                  field_type=value[1],
+                                  field_precision=value[2],
+                                  field_scale=value[3],
+                                  field_length=value[4],
+                                  field_alias=value[5])
+
 
-    # Process: FeatureCompare
-    compare_result = arcpy.TableCompare_management(
-        base_table, test_table, sort_field, compare_type, ignore_option, 
-        attribute_tolerance, omit_field, continue_compare, compare_file)
-    logger.info('outputed text file of the schema differences to the following location: %s', compare_file)
+def returnSourceFileFields():
+    ### defining field, type, precision, scale, length and alias
+    DIC_field_names_type = {
+            1: ['Source_File_ID', 'SHORT', '', '', '', 'Source File ID'],
+            2: ['File_Path', 'TEXT', '', '', '255', 'File Path'],
+            3: ['File_Hash', 'TEXT', '', '', '40', 'File Hash'],
+            4: ['File_Modified', 'DATE', '', '', '', 'File Modified']
+    }
+    return DIC_field_names_type
 
 
 # ------------------------------------------------
-# validates the fields to make sure they are the correct type, if not converts to correct field type
+# gives a workbook its source file id and returns its row for the source files table; id, path, hash and
+# modified time. a workbook keeps its id when it is loaded again, new workbooks get the next id. the row is
+# written by writeRows with the workbook's rows, so the table only changes once they are saved
 # ------------------------------------------------
-def fieldTypeConverter(output_temp):
-    fields = arcpy.ListFields(output_temp)
-    for field in fields:
-        field_name = field.name
-        field_type = field.type
-        # original field alias
-        field_alias_org = field.aliasName
-        # updated alias needed for of schema issues with the spreadsheet
-        field_name_alias_updated = field_name.replace('_', ' ')
-        ### this if statement is used to skip the ConvertTimeField tool if the field is already a date type
-        if field_name == 'Resolved_Date' or field_name == 'Observation_Date':
-            # also if the field alias is incorrect, the following scripts will fix the field up
-            if not field_type == 'Date' or field_alias_org != field_name_alias_updated:
-                logger.info('')
-                logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
-                logger.info('transferring values to new fields...')
-                ### add temp date field
-                logger.info('adding temp date field...')
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name='temp',
-                                                  field_type='Date',
-                                                  field_precision='',
-                                                  field_scale='',
-                                                  field_length='',
-                                                  field_alias=field_name_alias_updated)
-                ### convert strings that are in a date/month/year format into a date field
-                ### replace blank values or invalid strings with null. Need to do this because some blank values come across
-                ### as 01/01/2001. 
-                logger.info('replacing blank values and strings with nulls as it causes an error with conversions...')
-                codeblock = ("import datetime" + "\n" +
-                            "def fixDate(date):" + "\n" +
-                            "  if date == '':" + "\n" +
-                            "    return None" + "\n" +
-                            "  elif isinstance(date, basestring):" + "\n" +
-                            "    try:" + "\n" +
-                            "        output = datetime.datetime.strptime(date, '%d/%m/%Y')" + "\n" +
-                            "        return output" + "\n" +
-                            "    except:" + "\n" +
-                            "        return None" + "\n" +                             
-                            "  else:" + "\n" +
-                            "    return None")
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field='temp',
-                                            expression='fixDate(!' + field_name + '!)',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=codeblock)
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field=field_name)
-                logger.info('adding new %s field with updated schema...', field_name)
-                ### re-add updated resolved date field
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name=field_name,
-                                                  field_type='Date',
-                                                  field_precision='',
-                                                  field_scale='',
-                                                  field_length='',
-                                                  field_alias=field_name_alias_updated)
-                logger.info('temp field values to %s field...', field_name)
-                ### copy values to updated resolved field
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field=field_name,
-                                            expression='!temp!',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=None)
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field='temp')
-                
-        # making sure ID is the field type long        
-        elif field_name == 'ID':
-            # also if the field alias is incorrect, the following scripts will fix the field up
-            if not field_type == 'Long' or field_alias_org != field_name_alias_updated:
-                logger.info('')
-                logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
-                logger.info('transferring values to new fields...')
-                ### using this tool to transfer the vales to a long format
-                logger.info('creating temp field with the long format...')
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name='temp',
-                                                  field_type='Long',
-                                                  field_precision='',
-                                                  field_scale='',
-                                                  field_length='',
-                                                  field_alias='')
-                ### replace blank values or strings with null
-                logger.info('replacing blank values and strings with nulls as it causes an error with conversions...')
-                codeblock = """def fixID(id):
-                        if isinstance(id, basestring):
-                            return None
-                        elif id == '':
-                            return None
-                        else:
-                            return int(id)
-                        """
-                ### copy cleaned values to a temp field
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field='temp',
-                                            expression='fixID(!ID!)',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=codeblock)
-                logger.info('deleting original field...')
-                ### delete the original field which has the incorrect schema
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field=field_name)
-                logger.info('add original field with updated schema...')
-                ### re-add schema updated field a copy values over
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name=field_name,
-                                                  field_type='Long',
-                                                  field_precision='',
-                                                  field_scale='',
-                                                  field_length='',
-                                                  field_alias=field_name_alias_updated)
-                logger.info('copying values to updated original field...')
-                ### copy values to updated resolved field
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field=field_name,
-                                            expression='!temp!',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=None)
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field='temp')
-                
-        ### the following is used to make the numeric fields all doubles
-        elif field_name == 'KP':
-            # also if the field alias is incorrect, the following scripts will fix the field up
-            if not field_type == 'Double' or field_alias_org != field_name_alias_updated:
-                ### using this tool to transfer the vales from a string to a standard date format
-                logger.info('')
-                logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
-                logger.info('creating a temp Double field...')
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name='temp',
-                                                  field_type='Double',
-                                                  field_precision='9',
-                                                  field_scale='6',
-                                                  field_length='',
-                                                  field_alias='')
-                ### copy values to temp field
-                logger.info('copying values to temp field...')
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field='temp',
-                                            expression='!' + field_name + '!',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=None)
-                logger.info('deleting original field...')
-                ### delete the original field which has the incorrect schema
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field=field_name)
-                logger.info('add original field with updated schema...')
-                ### re-add schema updated field a copy values over
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name=field_name,
-                                                  field_type='Double',
-                                                  field_precision='9',
-                                                  field_scale='6',
-                                                  field_length='',
-                                                  field_alias=field_name_alias_updated)
-                logger.info('copying values to updated original field...')
-                ### copy values to updated resolved field
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field=field_name,
-                                            expression='!temp!',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=None)
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field='temp')
+def registerSourceFile(context, xlsx, file_hash):
+    source_files = context['source_files']
+    path = context['variables']['input_folder'] + xlsx
+    entry = source_files.get(xlsx)
+    if entry is None:
+        entry = {'id': max([value['id'] for value in source_files.values()] or [0]) + 1, 'path': path}
+        source_files[xlsx] = entry
+    return [entry['id'], path, file_hash, datetime.datetime.fromtimestamp(os.path.getmtime(path))]
 
-        ### the following is used to make check if a field is the correct type
-        elif (field_name == 'Pipeline_Patrol_State' or field_name == 'Sighting_Status'
-        or field_name == 'Pipeline_Patrol_Program' or field_name == 'Submitted_By'
-        or field_name == 'Sighting_Classification' or field_name == 'Location'
-        or field_name == 'Resolved_By' or field_name == 'Resolved_By'
-        or field_name == 'Corridor_Inspection_Classification'):
-            # also if the field alias is incorrect, the following scripts will fix the field up
-            if not field_type == 'String' or field_alias_org != field_name_alias_updated:
-                ### using this tool to transfer the vales from one type to another
-                logger.info('')
-                logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
-                logger.info('converting the field to another type...')
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name='temp',
-                                                  field_type='String',
-                                                  field_precision='',
-                                                  field_scale='',
-                                                  field_length='255',
-                                                  field_alias='')
-                ### copy values to temp field
-                logger.info('copying values to temp field...')
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field='temp',
-                                            expression='!' + field_name + '!',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=None)
-                logger.info('deleting original field...')
-                ### delete the original field which has the incorrect schema
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field=field_name)
-                logger.info('add original field with updated schema...')
-                ### re-add schema updated field a copy values over
-                arcpy.AddField_management(in_table=output_temp,
-                                                  field_name=field_name,
-                                                  field_type='String',
-                                                  field_precision='',
-                                                  field_scale='',
-                                                  field_length='255',
-                                                  field_alias=field_name_alias_updated)
-                logger.info('copying values to updated original field...')
-                ### copy values to updated field
-                arcpy.CalculateField_management(in_table=output_temp,
-                                            field=field_name,
-                                            expression='!temp!',
-                                            expression_type='PYTHON_9.3',
-                                            code_block=None)
-                # delete temp field
-                arcpy.DeleteField_management (in_table=output_temp,
-                                          drop_field='temp')
 
-    # create new comments actions required field and copy values from original field
-    #  the original field will be removed in fieldsToDelete function
-    arcpy.CalculateField_management(in_table=output_temp,
-                                    field="Comments_Actions_Req",
-                                    expression='!Comments___Actions_Req!',
-                                    expression_type='PYTHON_9.3',
-                                    code_block=None)
-    # if any other value other than yes, return no
-    logger.info('if any other value then yes, return no in Resolved field...')
-    codeblock = ("def null2No(resolve):" + "\n" +
-                "  if resolve == 'Yes':" + "\n" +
-                "    result = 'Yes'" + "\n" +
-                "    return result" + "\n" +
-                "  else:" + "\n" +
-                "    result = 'No'" + "\n" +
-                "    return result")
-    arcpy.CalculateField_management(in_table=output_temp,
-                                field='Resolved',
-                                expression='null2No(!Resolved!)',
-                                expression_type='PYTHON_9.3',
-                                code_block=codeblock)
-
-
-# ------------------------------------------------
-# create lat and long fields
-# ------------------------------------------------
-def createLatLong(output):
-    # create lat and long fields
-    arcpy.AddField_management(in_table=output,
-                                      field_name='Latitude',
-                                      field_type='Double',
-                                      field_precision='9',
-                                      field_scale='6',
-                                      field_length='',
-                                      field_alias='')
-    arcpy.AddField_management(in_table=output,
-                                      field_name='Longitude',
-                                      field_type='Double',
-                                      field_precision='9',
-                                      field_scale='6',
-                                      field_length='',
-                                      field_alias='')
-
-
-# ------------------------------------------------
-# this function will populate a Latitude and Longitude field in a table
-# ------------------------------------------------
-def calcLatLong(output):
-    # define variables
-    fields = arcpy.ListFields(output)
-    # cleanup the location field values so that special characters don't break the script
-    # and points are placed in the middle of Australia
-    logger.info('spliting location field into latitude and longitude fields...')
-    with arcpy.da.UpdateCursor(in_table=output,
-                                   field_names=['Location','Latitude','Longitude']) as cursor:
+# ------------------------------------------------
+# reads the source files table back into the workbook names, ids, hashes and modified times
+# ------------------------------------------------
+def loadSourceFiles(source_files_table):
+    source_files = {}
+    fields = [value[0] for key, value in sorted(returnSourceFileFields().items())]
+    with arcpy.da.SearchCursor(source_files_table, fields) as cursor:
+        for source_id, path, file_hash, modified in cursor:
+            source_files[os.path.basename(path)] = {'id': source_id, 'path': path, 'hash': file_hash,
+                                                    'modified': modified}
+    return source_files
+
+
+# ------------------------------------------------
+# builds a where clause selecting the rows loaded from the given source file ids
+# ------------------------------------------------
+def sourceFileWhereClause(source_ids):
+    return "Source_File_ID IN ({0})".format(', '.join(str(int(source_id)) for source_id in source_ids))
+
+
+# ------------------------------------------------
+# deletes the rows loaded from the given source file ids from a table or feature class
+# ------------------------------------------------
+def deleteSourceRows(in_table, source_ids):
+    if not source_ids:
+        return
+    count = 0
+    with arcpy.da.UpdateCursor(in_table, ['OID@'], sourceFileWhereClause(source_ids)) as cursor:
         for row in cursor:
-            if row[0] is None:
-                logger.info('%s has been changed due to incorrect format: null', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)
-            if re.search(r'[a-zA-Z]', row[0]):
-                logger.info('%s has been changed due to incorrect format: letters found', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)
-            if re.search(r'^(.*,.*,.*)$', row[0]):
-                logger.info('%s has been changed due to incorrect format: more' +
-                            ' than 1 comma found', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)
-            if re.search(r'^[^,]+$', row[0]):
-                logger.info('%s has been changed due to incorrect format: no comma found', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)   
-            if re.search(r'.*[.].*[.].*[.].*', row[0]):
-                logger.info('%s has been changed due to location containing three full stops', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)
-            if row[0] == '':
-                logger.info('%s has been changed due to empty location value', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)
-            if re.search(r'[^A-Za-z0-9.,\-]+', row[0]):
-                logger.info('%s has caused an issue due to an unnormal character and has been changed', row[0])
-                row[0] = '-26.006099,133.952746'
-                cursor.updateRow(row)
-            latitude, longitude = row[0].split(',',1)
-            row[1] = float(latitude) 
-            row[2] = float(longitude)
-            cursor.updateRow(row)
-    logger.info('latitude and longitude fields are populated...')
-    del cursor
+            cursor.deleteRow()
+            count += 1
+    logger.info('%s rows deleted from %s', count, in_table)
 
 
 # ------------------------------------------------
-# this function will use the Latitude and Longitude fields in the table to c
+# converts a sheet with ExcelToTable and fixes its schema with the column plan for its headers
 # ------------------------------------------------
-def createXYEvent(in_table, output, output_path, output_name):
-    x_field = 'Longitude'
-    y_field = 'Latitude'
-    z_field = ''
-    out_layer = 'XYevent'
-    # 4283 is the code for: 
-    #  GCS_GDA_1994 (Meters)
-    coordinate_system = arcpy.SpatialReference(4283)
-    arcpy.MakeXYEventLayer_management (in_table, x_field, y_field, out_layer, coordinate_system, z_field)
-    arcpy.FeatureClassToFeatureClass_conversion (out_layer, output_path, output_name)
-    
+def excelToTempTable(xlsx_path, output_temp, sheet, plan_cache, acceptedFieldList, alias_index):
+    arcpy.ExcelToTable_conversion (xlsx_path, output_temp, sheet)
+
+    ### work out what needs to change in the temp table's schema. the headers are only
+    ### listed once, if the same headers have been seen before the cached plan is used
+    fields = fieldDescriptors(output_temp)
+    plan = returnColumnPlan(plan_cache, fields, acceptedFieldList, alias_index)
+
+    ### adjust temp table's schema
+    logger.info('updating temp table schema...')
+    logger.info('renaming fields matched to accepted fields...')
+    renameFields(plan, output_temp)
+    logger.info('adding new fields...')
+    addFields(output_temp)
+
+    ### list fields and their information
+    fieldInfo(fields)
+
+    ### update field types in preparation for the append
+    fieldTypeConverter(output_temp, plan)
+
+    # if any fields from the spreadsheet template are missing, add it to the temp table
+    # must be done after the excel to table conversion, otherwise fields will be added with no values
+    # and when the conversion trys to take place it sees the field and does not copy the values over
+    logger.info('checking for missing fields from the spreadsheet template that need to be added...')
+    fieldsToAdd(plan, output_temp)
+
+    logger.info('deleting original fields that cause issue with schema...')
+    fieldsToDelete(plan, output_temp)
+    return plan
+
 
 # ------------------------------------------------
-# main function
+# spreadsheet templates in use by the regions. sheet is a pattern for the sheet name, header_row is the
+# row the headers are on (starting at 0) and columns maps headers that the alias index can't work out
 # ------------------------------------------------
-def main():
-    # setup logger
-    init_logger_singleton()
+def returnTemplates():
+    templates = [
+        {'name': 'operations', 'sheet': r'^Operations$', 'header_row': 0, 'columns': {}},
+        {'name': 'field services', 'sheet': r'^(Field Services|Corridor Condition.*)$', 'header_row': 0,
+         'columns': {}},
+        {'name': 'titled sheet', 'sheet': r'^(Operations|Field Services|Corridor Condition.*)$', 'header_row': 1,
+         'columns': {}},
+    ]
+    # a sheet only counts as a template match if this many of its headers are accepted fields
+    for template in templates:
+        template.setdefault('min_matches', 8)
+    return templates
 
-    # testing if try:except works when you wrap everything in the try 
-    try:
-        ### define global variables
-        # ------------------------------------------------
-        logger.info('Setting up environment & variables...\n')
-        workspace = environment()
-        output_gdb = workspace + "data.gdb/"
-        output_table = output_gdb + "CCI"
-        output_name = 'Corridor_Condition_Reports'
-        output_fc = output_gdb + output_name
-        output_temp_table = output_gdb + "temp"
-        input_folder = workspace + '_in/'
-        src_xlsx = r'http://thehub.apa.com.au/workareap/ID/IPP/Corridor%20Condition%20Reports/Field%20Services'
-        # defines the starting location of the list for the islice for loop 
-        xlsx_start_pt = 0
-        # ------------------------------------------------
 
+# ------------------------------------------------
+# picks the template for a workbook by reading only the header row of the sheets with a matching name
+# ------------------------------------------------
+def sniffTemplate(book, templates, alias_index):
+    best_match, best_score = None, 0
+    for template in templates:
+        for sheet_name in book.sheet_names():
+            if not re.search(template['sheet'], sheet_name, re.IGNORECASE):
+                continue
+            sheet = book.sheet_by_name(sheet_name)
+            if sheet.nrows <= template['header_row']:
+                continue
+            headers = [u'{0}'.format(value).strip() for value in sheet.row_values(template['header_row'])]
+            matched = set(template['columns'].get(header) or resolveHeader(alias_index, header)[0]
+                          for header in headers if header)
+            matched.discard(None)
+            if len(matched) >= template['min_matches'] and len(matched) > best_score:
+                best_match, best_score = (template, sheet_name, headers), len(matched)
+    return best_match
 
-    ##    logger.info('copying files from source location and moving to destination')
-    ##    copyFiles(src_xlsx, input_folder)
 
-        logger.info('CHECKING IF THE FOLLOWING FEATURE CLASS EXISTS:\n%s', output_gdb + '\n')
-        renewFC(workspace, output_gdb)
+# ------------------------------------------------
+# returns the row reader for a template and header layout, compiling it the first time it is seen
+# ------------------------------------------------
+def returnRowReader(compiled_readers, template, headers, alias_index, acceptedFields, datemode):
+    # the date converters are built for the workbook's date system, so 1900 and 1904 books get their own reader
+    key = (template['name'], tuple(headers), datemode)
+    if key not in compiled_readers:
+        logger.info('compiling row reader for the %s template...', template['name'])
+        compiled_readers[key] = compileRowReader(template, headers, alias_index, acceptedFields, datemode)
+    return compiled_readers[key]
 
-        logger.info('CONVERSION FROM XLSX TO FILE GEODATABASE TABLE...\n\n')    
-        excelToTable(workspace, output_gdb, output_temp_table, output_table, input_folder, xlsx_start_pt)
 
-        logger.info('creating Latitude and Longitude fields...')
-        createLatLong(output_table)
+# ------------------------------------------------
+# builds a function that turns the rows of a sheet into values in accepted field order, the header
+# matching and choice of converter is done here once instead of for every cell
+# ------------------------------------------------
+def compileRowReader(template, headers, alias_index, acceptedFields, datemode):
+    outputFields = [field for field in acceptedFields if field != 'OBJECTID']
+    columns = []
+    for column, header in enumerate(headers):
+        accepted_name = template['columns'].get(header)
+        if accepted_name is None and header:
+            accepted_name, match_type = resolveHeader(alias_index, header)
+            if accepted_name is not None and header != accepted_name:
+                logger.info('header %s matched to %s (%s match)', header, accepted_name, match_type)
+        if accepted_name in outputFields and accepted_name not in [c[1] for c in columns]:
+            columns.append([column, accepted_name, returnCellConverter(accepted_name, datemode)])
+        elif header:
+            logger.info('the %s column is not an accepted field and will not be read', header)
+    columns = [(column, accepted_name, outputFields.index(accepted_name), converter)
+               for column, accepted_name, converter in columns]
+    first_row = template['header_row'] + 1
+    width = len(outputFields)
 
-        logger.info('checking if location value has data errors.  co-ord -26.006099,133.952746 is assigned to any errors...')
-        calcLatLong(output_table)
+    def reader(sheet, path_counts=None):
+        row_count = max(sheet.nrows - first_row, 0)
+        sample = sampleRows(row_count, 50, 50)
+        values = [[None] * row_count for position in range(width)]
+        # each column is typed from a sample of its cells and read down the fastest path it can take
+        for column, accepted_name, position, converter in columns:
+            if column >= sheet.ncols:
+                continue
+            column_types = sheet.col_types(column, first_row)
+            column_values = sheet.col_values(column, first_row)
+            classification = inferColumnType(column_types, column_values, sample,
+                                             returnFieldTargetType(accepted_name))
+            values[position], path = readColumn(column_types, column_values, classification, converter, datemode)
+            logger.info('%s column is %s, read by %s', accepted_name, classification, path)
+            if converter.max_length:
+                values[position], cut = limitTextLength(values[position], converter.max_length)
+                if cut:
+                    logger.info('%s values in the %s column were longer than %s characters and were cut short',
+                                cut, accepted_name, converter.max_length)
+            if path_counts is not None:
+                path_counts[path] = path_counts.get(path, 0) + 1
+        for row in zip(*values):
+            yield list(row)
 
-        logger.info('create feature class from CCI table...')
-        createXYEvent(output_table, output_fc, output_gdb, output_name)
-        
-        logger.info('SCRIPT FINISHED')
-    except WindowsError as e:
-        logger.info("Windows Error")
-        logger.info('Exception:\n %s' % repr(e))
-        sys.exit()
+    return reader
+
+
+# ------------------------------------------------
+# picks the rows used to type a column; the first rows plus a random sample of the rest
+# ------------------------------------------------
+def sampleRows(row_count, first_n, sample_n):
+    sample = list(range(min(first_n, row_count)))
+    if row_count > first_n:
+        # seeded so the same workbook is always typed the same way
+        rest = range(first_n, row_count)
+        sample += random.Random(row_count).sample(rest, min(sample_n, len(rest)))
+    return sample
+
+
+# ------------------------------------------------
+# classifies a column from the types of its sampled cells
+# ------------------------------------------------
+def inferColumnType(column_types, column_values, sample, target_type):
+    kinds = set(column_types[i] for i in sample) - set([xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK])
+    if not kinds:
+        return 'empty'
+    elif kinds == set([xlrd.XL_CELL_DATE]):
+        return 'clean date'
+    elif kinds == set([xlrd.XL_CELL_NUMBER]):
+        return 'clean number'
+    elif kinds == set([xlrd.XL_CELL_TEXT]):
+        if target_type == 'Double' or target_type == 'Long':
+            return 'numeric as text'
+        elif target_type == 'Date':
+            return 'date as text'
+        return 'clean text'
+    elif kinds == set([xlrd.XL_CELL_DATE, xlrd.XL_CELL_TEXT]):
+        return 'mixed date/text'
+    elif kinds == set([xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_TEXT]):
+        return 'mixed number/text'
+    return 'mixed'
+
+
+# ------------------------------------------------
+# reads a column of cells into values of the accepted field type. clean columns are passed straight
+# through or through a single conversion, anything else is converted cell by cell. returns the values
+# and the path taken
+# ------------------------------------------------
+def readColumn(column_types, column_values, classification, converter, datemode):
+    blank = set([xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK])
+    expected = {'empty': set(),
+                'clean date': set([xlrd.XL_CELL_DATE]),
+                'clean number': set([xlrd.XL_CELL_NUMBER]),
+                'clean text': set([xlrd.XL_CELL_TEXT])}.get(classification)
+    target = converter.target_type
+    if target == 'Date':
+        # error cells such as #N/A hold their error code and boolean cells 0 or 1, both would read as serial
+        # dates so they are blanked first
+        if set(column_types) & set([xlrd.XL_CELL_ERROR, xlrd.XL_CELL_BOOLEAN]):
+            column_values = [value if cell_type in (xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_DATE, xlrd.XL_CELL_TEXT)
+                             else None for cell_type, value in zip(column_types, column_values)]
+        # date columns are always converted a column at a time, the path only says whether the column was clean
+        dates, counts = convertDateColumn(column_values, datemode)
+        logger.info('dates read: %s', formatCounts(counts))
+        return dates, 'fast' if classification in ('clean date', 'clean number', 'empty') else 'coerce'
+    if expected is not None:
+        # the sample can miss a dirty cell, so the cell types of the whole column are checked before
+        # taking a fast path. this is a set over a list xlrd has already built, not a conversion
+        found = set(column_types)
+        has_blanks = bool(found & blank)
+        if not found - blank - expected:
+            if classification == 'empty':
+                return [None] * len(column_values), 'empty'
+            if not has_blanks and ((classification == 'clean number' and target == 'Double')
+                                   or (classification == 'clean text' and target == 'String')):
+                return column_values, 'pass through'
+            if classification == 'clean number' and target == 'Double':
+                return [None if value == '' else value for value in column_values], 'fast'
+            if classification == 'clean number' and target == 'Long':
+                return [None if value == '' else int(value) for value in column_values], 'fast'
+            if classification == 'clean text' and target == 'String':
+                return [None if value == '' else value for value in column_values], 'fast'
+    return [converter(cell_type, value) for cell_type, value in zip(column_types, column_values)], 'coerce'
+
+
+# ------------------------------------------------
+# cuts text values down to the length of their field, the insert fails on a value that doesn't fit.
+# returns the values and how many were cut
+# ------------------------------------------------
+def limitTextLength(values, max_length):
+    cut = [i for i, value in enumerate(values) if value is not None and len(value) > max_length]
+    if not cut:
+        return values, 0
+    values = list(values)
+    for i in cut:
+        values[i] = values[i][:max_length]
+    return values, len(cut)
+
+
+# ------------------------------------------------
+# date formats typed into the spreadsheets, tried in order
+# ------------------------------------------------
+def returnDateFormats():
+    dateFormats = ['%d/%m/%Y', '%d/%m/%y', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S',
+                   '%Y-%m-%dT%H:%M:%S', '%d-%m-%Y', '%d.%m.%Y', '%d %b %Y', '%d %B %Y', '%d-%b-%Y', '%d-%b-%y']
+    return dateFormats
+
+
+# ------------------------------------------------
+# dates that are put in the spreadsheets in place of a blank value
+# ------------------------------------------------
+def returnDateSentinels():
+    # 01/01/2001 comes across for some blank values. serial 0 is excel's own blank date, it reads as
+    # 31/12/1899 once the leap year bug is allowed for and as 30/12/1899 from tools that don't
+    dateSentinels = [datetime.datetime(2001, 1, 1), datetime.datetime(1899, 12, 30),
+                     datetime.datetime(1899, 12, 31)]
+    return dateSentinels
+
+
+# ------------------------------------------------
+# converts a whole column of values into dates. numbers are excel serial dates and are converted together
+# as an array, strings are parsed once for each distinct value and datetimes are kept. returns the dates
+# and a count of how many values went each way
+# ------------------------------------------------
+def convertDateColumn(values, datemode, dateFormats=None, dateSentinels=None):
+    dateFormats = dateFormats or returnDateFormats()
+    sentinels = numpy.array(dateSentinels or returnDateSentinels(), dtype='datetime64[s]')
+    count = len(values)
+    result = numpy.empty(count, dtype=object)
+    counts = {}
+
+    # one pass to sort the values by kind; 0 blank, 1 number, 2 text, 3 date, 4 anything else
+    def kind(value):
+        if value is None or value == '':
+            return 0
+        elif isinstance(value, bool):
+            return 4
+        elif isinstance(value, (int, float)) or type(value).__name__ == 'long':
+            return 1
+        elif isinstance(value, datetime.datetime):
+            return 3
+        elif hasattr(value, 'strip'):
+            return 2 if value.strip() else 0
+        return 4
+    kinds = numpy.array([kind(value) for value in values], dtype=numpy.int8)
+    objects = numpy.array(values, dtype=object) if count else numpy.empty(0, dtype=object)
+    counts['blank'] = int(numpy.count_nonzero(kinds == 0))
+    counts['invalid'] = int(numpy.count_nonzero(kinds == 4))
+
+    # excel serial numbers. in the 1900 date system excel counts 29/02/1900, which never happened,
+    # so serials before it are a day out and serial 60 isn't a real date
+    numbers = numpy.nonzero(kinds == 1)[0]
+    if len(numbers):
+        serials = objects[numbers].astype(numpy.float64)
+        if datemode == 1:
+            base = numpy.datetime64('1904-01-01T00:00:00')
+            valid = serials >= 0
+        else:
+            base = numpy.datetime64('1899-12-30T00:00:00')
+            valid = (serials >= 0) & (serials != 60)
+            serials = numpy.where(serials < 60, serials + 1, serials)
+        # excel's last day is 31/12/9999
+        valid &= serials < 2958466
+        seconds = numpy.round(numpy.where(valid, serials, 0) * 86400).astype(numpy.int64)
+        dates = base + seconds.astype('timedelta64[s]')
+        placeholder = valid & numpy.in1d(dates, sentinels)
+        keep = valid & ~placeholder
+        result[numbers[keep]] = dates[keep].astype(object)
+        counts['serial'] = int(numpy.count_nonzero(keep))
+        counts['placeholder'] = int(numpy.count_nonzero(placeholder))
+        counts['invalid'] += int(numpy.count_nonzero(~valid))
+
+    # strings repeat a lot down a column, so each distinct string is only parsed once
+    strings = numpy.nonzero(kinds == 2)[0]
+    if len(strings):
+        unique, inverse = numpy.unique(numpy.array([value.strip() for value in objects[strings]], dtype=object),
+                                       return_inverse=True)
+        occurrences = numpy.bincount(inverse)
+        parsed = numpy.empty(len(unique), dtype=object)
+        for i, text in enumerate(unique):
+            label = 'invalid'
+            for dateFormat in dateFormats:
+                try:
+                    parsed[i] = datetime.datetime.strptime(text, dateFormat)
+                    label = dateFormat
+                    break
+                except ValueError:
+                    continue
+            if parsed[i] is not None and numpy.datetime64(parsed[i], 's') in sentinels:
+                parsed[i] = None
+                label = 'placeholder'
+            counts[label] = counts.get(label, 0) + int(occurrences[i])
+        result[strings] = parsed[inverse]
+
+    # values that are already dates only need the placeholder check
+    dates = numpy.nonzero(kinds == 3)[0]
+    if len(dates):
+        placeholder = numpy.in1d(objects[dates].astype('datetime64[s]'), sentinels)
+        result[dates[~placeholder]] = objects[dates[~placeholder]]
+        counts['date'] = int(numpy.count_nonzero(~placeholder))
+        counts['placeholder'] = counts.get('placeholder', 0) + int(numpy.count_nonzero(placeholder))
+
+    return result.tolist(), dict((label, n) for label, n in counts.items() if n)
+
+
+# ------------------------------------------------
+# converts a field of a table into dates with convertDateColumn and writes them into another field
+# ------------------------------------------------
+def convertDateField(in_table, field_name, output_field):
+    with arcpy.da.SearchCursor(in_table, [field_name]) as cursor:
+        values = [row[0] for row in cursor]
+    # ExcelToTable doesn't say which date system the workbook used, the 1900 system is the default
+    dates, counts = convertDateColumn(values, 0)
+    logger.info('%s dates read: %s', field_name, formatCounts(counts))
+    with arcpy.da.UpdateCursor(in_table, [output_field]) as cursor:
+        for row, date in zip(cursor, dates):
+            row[0] = date
+            cursor.updateRow(row)
+
+
+# ------------------------------------------------
+# formats a dictionary of counts for the log
+# ------------------------------------------------
+def formatCounts(counts):
+    return ', '.join('{0} {1}'.format(count, label) for label, count in sorted(counts.items()))
+
+
+# ------------------------------------------------
+# returns the function that converts a cell into the type of the accepted field
+# ------------------------------------------------
+def returnCellConverter(field_name, datemode):
+    target_type = returnFieldTargetType(field_name)
+
+    def toDate(cell_type, value):
+        # excel dates are numbers, dates typed in as text are expected as day/month/year
+        if cell_type == xlrd.XL_CELL_DATE or cell_type == xlrd.XL_CELL_NUMBER:
+            try:
+                return datetime.datetime(*xlrd.xldate_as_tuple(value, datemode))
+            except (ValueError, xlrd.XLDateError):
+                return None
+        elif cell_type == xlrd.XL_CELL_TEXT:
+            try:
+                return datetime.datetime.strptime(value.strip(), '%d/%m/%Y')
+            except ValueError:
+                return None
+        return None
+
+    def toLong(cell_type, value):
+        # same as fixID, text in the ID field becomes null
+        if cell_type == xlrd.XL_CELL_NUMBER:
+            return int(value)
+        return None
+
+    def toDouble(cell_type, value):
+        if cell_type == xlrd.XL_CELL_NUMBER:
+            return value
+        elif cell_type == xlrd.XL_CELL_TEXT:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+        return None
+
+    def toText(cell_type, value):
+        if cell_type == xlrd.XL_CELL_TEXT:
+            return value if value != '' else None
+        elif cell_type == xlrd.XL_CELL_NUMBER:
+            # whole numbers come out of excel as floats, drop the .0 so they read the same as typed
+            return u'{0}'.format(int(value)) if value == int(value) else u'{0}'.format(value)
+        elif cell_type == xlrd.XL_CELL_DATE:
+            date = toDate(cell_type, value)
+            return date.strftime('%d/%m/%Y') if date is not None else None
+        elif cell_type == xlrd.XL_CELL_BOOLEAN:
+            return u'Yes' if value else u'No'
+        return None
+
+    if target_type == 'Date':
+        converter = toDate
+    elif target_type == 'Long':
+        converter = toLong
+    elif target_type == 'Double':
+        converter = toDouble
+    else:
+        converter = toText
+    # readColumn uses the target type to pick a fast path for clean columns
+    converter.target_type = target_type or 'String'
+    # text is cut to the length of its field once the column is read
+    definition = returnFieldDefinition(field_name)
+    converter.max_length = None
+    if converter.target_type == 'String' and definition is not None and definition[3]:
+        converter.max_length = int(definition[3])
+    return converter
+
+
+# ------------------------------------------------
+# the one definition of every field in the output table, the accepted fields, field types, temp table
+# fields and output fields are all worked out from here. the role says where a field comes from:
+#   key        - created by the geodatabase
+#   accepted   - read from the spreadsheets
+#   provenance - the workbook and spreadsheet row each row came from
+#   derived    - worked out from the accepted fields once they are read
+# ------------------------------------------------
+def returnSchema():
+    ### defining field, type, precision, scale, length, alias and role
+    DIC_schema = {
+            1: ['OBJECTID', 'OID', '', '', '', 'OBJECTID', 'key'],
+            2: ['Pipeline_Patrol_State', 'String', '', '', '255', 'Pipeline Patrol State', 'accepted'],
+            3: ['Sighting_Status', 'String', '', '', '255', 'Sighting Status', 'accepted'],
+            4: ['ID', 'Long', '', '', '', 'ID', 'accepted'],
+            5: ['Pipeline_Patrol_Program', 'String', '', '', '255', 'Pipeline Patrol Program', 'accepted'],
+            6: ['Submitted_By', 'String', '', '', '255', 'Submitted By', 'accepted'],
+            7: ['Observation_Date', 'Date', '', '', '', 'Observation Date', 'accepted'],
+            8: ['Sighting_Classification', 'String', '', '', '255', 'Sighting Classification', 'accepted'],
+            9: ['Comments_Actions_Req', 'String', '', '', '2000', 'Comments Actions Req', 'accepted'],
+            10: ['Location', 'String', '', '', '255', 'Location', 'accepted'],
+            11: ['KP', 'Double', '9', '6', '', 'KP', 'accepted'],
+            12: ['Resolved', 'String', '', '', '255', 'Resolved', 'accepted'],
+            13: ['Resolved_Date', 'Date', '', '', '', 'Resolved Date', 'accepted'],
+            14: ['Resolved_By', 'String', '', '', '255', 'Resolved By', 'accepted'],
+            15: ['MP_for_RBP_only', 'String', '', '', '255', 'MP for RBP only', 'accepted'],
+            16: ['APA_Encroachment_Number', 'String', '', '', '255', 'APA Encroachment Number', 'accepted'],
+            17: ['Corridor_Inspection_Classification', 'String', '', '', '255',
+                 'Corridor Inspection Classification', 'accepted'],
+            18: ['Source_File_ID', 'Short', '', '', '', 'Source File ID', 'provenance'],
+            19: ['Source_Row', 'Long', '', '', '', 'Source Row', 'provenance'],
+            20: ['Latitude', 'Double', '9', '6', '', '', 'derived'],
+            21: ['Longitude', 'Double', '9', '6', '', '', 'derived'],
+            22: ['Pipeline_Name', 'String', '', '', '255', 'Pipeline Name', 'derived'],
+            23: ['Centreline_KP', 'Double', '9', '6', '', 'Centreline KP', 'derived'],
+            24: ['Centreline_Offset', 'Double', '9', '2', '', 'Centreline Offset', 'derived'],
+            25: ['Off_Centreline', 'String', '', '', '255', 'Off Centreline', 'derived']
+    }
+    return DIC_schema
+
+
+# ------------------------------------------------
+# returns the type, precision, scale, length and alias a field is created with
+# ------------------------------------------------
+def returnFieldDefinition(field_name):
+    for value in returnSchema().values():
+        if value[0] == field_name:
+            return value[1:6]
+    return None
+
+
+# -----------------------------------------
+# add fields and their properties to the designated fc using a dictionary and lists
+# -----------------------------------------
+def addFields(in_table):
+    logger.info("adding fields to " + in_table + '\n')
+    DIC_field_names_type = returnNewFieldDict()
+
+    """add fields to the feature class based off the values in dictionary"""
+    for key, value in DIC_field_names_type.iteritems():
+                    arcpy.AddField_management(in_table=in_table,
+                                              field_name=value[0],
+                                              field_type=value[1],
+                                              field_precision=value[2],
+                                              field_scale=value[3],
+                                              field_length=value[4],
+                                              field_alias=value[5])
+
+
+# -----------------------------------------
+# fields added to every temp table by addFields; accepted text fields longer than the 255 characters
+# ExcelToTable gives a text column, their values are copied across by the column plan
+# -----------------------------------------
+def returnNewFieldDict():
+    ### defining field, type, precision, scale, length and alias
+    DIC_field_names_type = {}
+    for key, value in returnSchema().items():
+        if value[6] == 'accepted' and value[1] == 'String' and value[4] != '255':
+            DIC_field_names_type[key] = value[:6]
+    return DIC_field_names_type
+
+
+# ------------------------------------------------
+# display information about fields; names, types and lengths
+# ------------------------------------------------
+def fieldInfo(fields):
+    logger.info("displaying field names and type:")
+
+    for field in fields:
+        logger.info("%s is a type of %s with a length of %s"
+              ,field['name'], field['type'], field['length'])
+
+
+# ------------------------------------------------
+# list the fields of a table once as plain values so they can be fingerprinted and cached
+# ------------------------------------------------
+def fieldDescriptors(in_table):
+    fields = []
+    for field in arcpy.ListFields(in_table):
+        fields.append({'name': field.name,
+                       'type': field.type,
+                       'length': field.length,
+                       'alias': field.aliasName})
+    return fields
+
+
+# ------------------------------------------------
+# creates a fingerprint of the spreadsheet headers so the same layout can be recognised next run
+# ------------------------------------------------
+def headerFingerprint(fields):
+    # headers and aliases can have accented letters, so the text is built as unicode and hashed as utf-8
+    header = u'\n'.join(u'{0}|{1}|{2}|{3}'.format(field['name'], field['type'], field['length'], field['alias'])
+                        for field in fields)
+    return hashlib.sha1(header.encode('utf-8')).hexdigest()
+
+
+# ------------------------------------------------
+# returns the field type each field needs to be in before the append, from returnSchema
+# ------------------------------------------------
+def returnFieldTargetType(field_name):
+    definition = returnFieldDefinition(field_name)
+    if definition is None or definition[0] == 'OID':
+        return None
+    return definition[0]
+
+
+# ------------------------------------------------
+# works out the column plan for a temp table; fields to copy, convert, add and drop
+# ------------------------------------------------
+def buildColumnPlan(fields, acceptedFields, alias_index):
+    plan = {'rename': [], 'copy': [], 'coerce': [], 'add': [], 'drop': [], 'matches': []}
+    newFields = [value[0] for value in returnNewFieldDict().values()]
+    fieldNames = [field['name'] for field in fields]
+    # accepted fields already in the table keep their values, other headers can't be matched onto them
+    resolvedNames = [name for name in fieldNames if name in acceptedFields]
+
+    for field in fields:
+        field_name = field['name']
+        field_alias = field['alias']
+        if field_name not in acceptedFields:
+            accepted_name, match_type = resolveHeader(alias_index, field_name)
+            if accepted_name is None or accepted_name in resolvedNames:
+                plan['drop'].append(field_name)
+                continue
+            logger.info('header %s matched to %s (%s match)', field_name, accepted_name, match_type)
+            plan['matches'].append([field_name, accepted_name, match_type])
+            resolvedNames.append(accepted_name)
+            if accepted_name in newFields:
+                # the field is created by addFields with its own schema, so the values are copied
+                # across and the original field will be removed in fieldsToDelete function
+                plan['copy'].append([field_name, accepted_name])
+                plan['drop'].append(field_name)
+                continue
+            plan['rename'].append([field_name, accepted_name])
+            field_name = accepted_name
+            field_alias = accepted_name.replace('_', ' ')
+
+        target_type = returnFieldTargetType(field_name)
+        # updated alias needed for of schema issues with the spreadsheet
+        field_name_alias_updated = field_name.replace('_', ' ')
+        if target_type is not None and (field['type'] != target_type
+                                        or field_alias != field_name_alias_updated):
+            plan['coerce'].append([field_name, field['type'], target_type])
+
+    # fields created by addFields are already there by the time fieldsToAdd runs
+    for acceptedField in acceptedFields:
+        if acceptedField not in resolvedNames and acceptedField not in newFields:
+            plan['add'].append(acceptedField)
+
+    return plan
+
+
+# ------------------------------------------------
+# other names the spreadsheet headers have been seen with, add to this as new ones turn up
+# ------------------------------------------------
+def returnHeaderSynonyms():
+    DIC_header_synonyms = {
+        'Comments_Actions_Req': ['Comments', 'Actions Required', 'Comments Actions Required'],
+        'KP': ['Kilometre Point', 'Kilometer Point', 'Chainage'],
+        'Observation_Date': ['Date Observed', 'Observed Date', 'Date'],
+        'Resolved_Date': ['Date Resolved'],
+        'Submitted_By': ['Submitted', 'Reported By'],
+        'MP_for_RBP_only': ['MP', 'MP for RBP'],
+        'APA_Encroachment_Number': ['Encroachment Number', 'Encroachment No'],
+    }
+    return DIC_header_synonyms
+
+
+# ------------------------------------------------
+# folds case, spaces and punctuation so 'Comments / Actions Req' and Comments___Actions_Req are the same
+# ------------------------------------------------
+def normaliseHeader(header):
+    return re.sub(r'[^a-z0-9]', '', header.lower())
+
+
+# ------------------------------------------------
+# builds the lookup of normalised header -> accepted field name, done once per run
+# ------------------------------------------------
+def buildAliasIndex(acceptedFields, synonyms):
+    alias_index = {'aliases': {}, 'resolved': {}}
+    for acceptedField in acceptedFields:
+        alias_index['aliases'][normaliseHeader(acceptedField)] = acceptedField
+    for acceptedField, headers in synonyms.items():
+        for header in headers:
+            alias_index['aliases'].setdefault(normaliseHeader(header), acceptedField)
+    return alias_index
+
+
+# ------------------------------------------------
+# number of single character edits needed to turn one string into another
+# ------------------------------------------------
+def editDistance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a):
+        current = [i + 1]
+        for j, char_b in enumerate(b):
+            current.append(min(previous[j + 1] + 1,
+                               current[j] + 1,
+                               previous[j] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+# ------------------------------------------------
+# matches a header to an accepted field, returns the field name and how it was matched
+# ------------------------------------------------
+def resolveHeader(alias_index, header, max_distance=2):
+    key = normaliseHeader(header)
+    accepted_name = alias_index['aliases'].get(key)
+    if accepted_name is not None:
+        if normaliseHeader(accepted_name) == key:
+            return accepted_name, 'normalised'
+        return accepted_name, 'synonym'
+
+    # headers that missed the index are only worked out once, repeats come from the resolved lookup
+    if key not in alias_index['resolved']:
+        best_name, best_distance = None, None
+        # short names like KP and ID would match almost anything, so they need a closer match
+        for alias, name in alias_index['aliases'].items():
+            allowed = min(max_distance, len(alias) // 4)
+            if allowed == 0 or abs(len(alias) - len(key)) > allowed:
+                continue
+            distance = editDistance(key, alias)
+            if distance <= allowed and (best_distance is None or distance < best_distance):
+                best_name, best_distance = name, distance
+        alias_index['resolved'][key] = best_name
+    if alias_index['resolved'][key] is None:
+        return None, None
+    return alias_index['resolved'][key], 'fuzzy'
+
+
+# ------------------------------------------------
+# renames headers that were matched to an accepted field
+# ------------------------------------------------
+def renameFields(plan, in_table):
+    for field_name, accepted_name in plan['rename']:
+        # field names are not case sensitive in a geodatabase, so a change of case goes through a temp name
+        if field_name.lower() == accepted_name.lower():
+            arcpy.AlterField_management(in_table, field_name, 'temp')
+            field_name = 'temp'
+        arcpy.AlterField_management(in_table, field_name, accepted_name, accepted_name.replace('_', ' '))
+        logger.info('the %s field has been renamed to %s', field_name, accepted_name)
+
+
+# ------------------------------------------------
+# returns the cached column plan for the headers, otherwise builds and caches a new one
+# ------------------------------------------------
+def returnColumnPlan(plan_cache, fields, acceptedFields, alias_index):
+    # the accepted fields, synonyms and schema are part of the fingerprint so a change to them builds a new plan
+    fingerprint = headerFingerprint(fields + [{'name': name, 'type': 'alias', 'length': '', 'alias': alias}
+                                              for alias, name in sorted(alias_index['aliases'].items())]
+                                    + [{'name': value[0], 'type': value[1], 'length': value[4], 'alias': value[5]}
+                                       for key, value in sorted(returnSchema().items())])
+    entry = plan_cache['plans'].get(fingerprint)
+    if entry is None:
+        logger.info('new spreadsheet header layout found (%s), building column plan...', fingerprint)
+        entry = {'plan': buildColumnPlan(fields, acceptedFields, alias_index), 'hits': 0}
+        plan_cache['plans'][fingerprint] = entry
+    else:
+        logger.info('spreadsheet header layout seen before (%s), using cached column plan...', fingerprint)
+        entry['hits'] += 1
+        for header, accepted_name, match_type in entry['plan']['matches']:
+            logger.info('header %s matched to %s (%s match)', header, accepted_name, match_type)
+    entry['last_run'] = plan_cache['run']
+    return entry['plan']
+
+
+# ------------------------------------------------
+# loads the header/column plan cache from disk, starting a new cache if none exists. each merge counts as a
+# run, the reloads of watch mode read the cache again without starting a new run
+# ------------------------------------------------
+def loadPlanCache(cache_file, new_run=True):
+    plan_cache = {'run': 0, 'plans': {}}
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                plan_cache = json.load(f)
+        except ValueError:
+            logger.info('column plan cache %s could not be read, starting a new one', cache_file)
+    if new_run:
+        plan_cache['run'] += 1
+    logger.info('column plan cache has %s header layouts', len(plan_cache['plans']))
+    return plan_cache
+
+
+# ------------------------------------------------
+# saves the header/column plan cache, dropping layouts that have not been used for a number of runs
+# ------------------------------------------------
+def savePlanCache(cache_file, plan_cache, max_idle_runs):
+    for fingerprint in list(plan_cache['plans']):
+        if plan_cache['run'] - plan_cache['plans'][fingerprint]['last_run'] >= max_idle_runs:
+            logger.info('removing header layout %s from column plan cache, unused for %s runs',
+                        fingerprint, max_idle_runs)
+            del plan_cache['plans'][fingerprint]
+    with open(cache_file, 'w') as f:
+        json.dump(plan_cache, f, indent=2, sort_keys=True)
+
+
+# ------------------------------------------------
+# used as the list of accepted fields for the table, from returnSchema
+# ------------------------------------------------
+def returnAcceptedFieldList():
+    # Latitude and longitude are not accepted, they are worked out from Location once the rows are read
+    acceptedFieldList = [value[0] for key, value in sorted(returnSchema().items())
+                         if value[6] == 'key' or value[6] == 'accepted']
+    return acceptedFieldList
+
+
+# ------------------------------------------------
+# deletes fields that are not defined in the list of accepted fields
+# ------------------------------------------------
+def fieldsToDelete(plan, in_table):
+    for field_name in plan['drop']:
+        arcpy.DeleteField_management (in_table=in_table,
+                                  drop_field=field_name)
+        logging.info('the %s field has been dropped', field_name)
+
+
+# ------------------------------------------------
+# adds fields that are missing from the excel template spreadsheet
+# ------------------------------------------------
+def fieldsToAdd(plan, in_table):
+    for acceptedField in plan['add']:
+        # creating field as String. If type needs to be adjusted, this can be setup in the fieldTypeConverter
+        arcpy.AddField_management(in_table=in_table,
+                                          field_name=acceptedField,
+                                          field_type='TEXT',
+                                          field_precision='',
+                                          field_scale='',
+                                          field_length='255',
+                                          field_alias='')           
+
+
+# ------------------------------------------------
+# compare the schemas of the input and output table
+# ------------------------------------------------
+def compareTables(base_fields, test_fields, compare_file, xlsx, ignore_missing=False, check_alias=True):
+    issues = schemaDiff(base_fields, test_fields, ignore_missing, check_alias)
+    if issues:
+        for issue in issues:
+            logger.info('%s: %s (base: %s, test: %s)', xlsx, issue['message'], issue['base'], issue['test'])
+        with open(compare_file, 'w') as f:
+            json.dump({'file': xlsx, 'issues': issues}, f, indent=2, sort_keys=True)
+        logger.info('outputed json file of the schema differences to the following location: %s', compare_file)
+    return issues
+
+
+# ------------------------------------------------
+# compares two lists of fields from fieldDescriptors and returns the differences, the same checks
+# TableCompare reports in schema_issues.txt. ignore_missing skips fields only in one table, for when
+# fields are matched by name, and check_alias can be turned off when rows are copied with cursors
+# ------------------------------------------------
+def schemaDiff(base_fields, test_fields, ignore_missing=False, check_alias=True):
+    # variant type codes TableCompare reports for each field type
+    DIC_var_types = {'SmallInteger': 2, 'Integer': 3, 'Long': 3, 'OID': 3, 'Single': 4, 'Double': 5,
+                     'Date': 7, 'String': 8, 'Text': 8, 'GUID': 8, 'GlobalID': 8}
+    # field names aren't case sensitive in a geodatabase
+    base = dict((field['name'].lower(), field) for field in base_fields if field['type'] != 'OID')
+    test = dict((field['name'].lower(), field) for field in test_fields if field['type'] != 'OID')
+    issues = []
+
+    def issue(field_name, message, base_value, test_value):
+        issues.append({'field': field_name, 'message': message, 'base': base_value, 'test': test_value})
+
+    for key, base_field in sorted(base.items()):
+        test_field = test.get(key)
+        name = base_field['name']
+        if test_field is None:
+            if not ignore_missing:
+                issue(name, 'Field {0} is missing from the test table'.format(name), name, None)
+            continue
+        if check_alias and base_field['alias'] != test_field['alias']:
+            issue(name, 'Field {0} aliases are different'.format(name), base_field['alias'], test_field['alias'])
+        if base_field['type'] != test_field['type']:
+            issue(name, 'Field {0} types are different'.format(name), base_field['type'], test_field['type'])
+        if base_field['length'] != test_field['length']:
+            issue(name, 'Field {0} lengths are different'.format(name), base_field['length'], test_field['length'])
+        if DIC_var_types.get(base_field['type']) != DIC_var_types.get(test_field['type']):
+            issue(name, 'Field {0} var type is different'.format(name),
+                  DIC_var_types.get(base_field['type']), DIC_var_types.get(test_field['type']))
+    for key, test_field in sorted(test.items()):
+        if key not in base and not ignore_missing:
+            issue(test_field['name'], 'Field {0} is missing from the base table'.format(test_field['name']),
+                  None, test_field['name'])
+    return issues
+
+
+# ------------------------------------------------
+# validates the fields to make sure they are the correct type, if not converts to correct field type
+# ------------------------------------------------
+def fieldTypeConverter(output_temp, plan):
+    for field_name, field_type, target_type in plan['coerce']:
+        # updated alias needed for of schema issues with the spreadsheet
+        field_name_alias_updated = field_name.replace('_', ' ')
+        ### only fields in the column plan are converted, fields already the right type are skipped
+        if target_type == 'Date':
+            logger.info('')
+            logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
+            logger.info('transferring values to new fields...')
+            ### add temp date field
+            logger.info('adding temp date field...')
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name='temp',
+                                              field_type='Date',
+                                              field_precision='',
+                                              field_scale='',
+                                              field_length='',
+                                              field_alias=field_name_alias_updated)
+            ### convert the values into dates a column at a time, excel serial numbers and the date formats
+            ### in returnDateFormats are read, blank values, invalid strings and placeholder dates become null.
+            ### Need to do this because some blank values come across as 01/01/2001.
+            logger.info('replacing blank values and strings with nulls as it causes an error with conversions...')
+            convertDateField(output_temp, field_name, 'temp')
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field=field_name)
+            logger.info('adding new %s field with updated schema...', field_name)
+            ### re-add updated resolved date field
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name=field_name,
+                                              field_type='Date',
+                                              field_precision='',
+                                              field_scale='',
+                                              field_length='',
+                                              field_alias=field_name_alias_updated)
+            logger.info('temp field values to %s field...', field_name)
+            ### copy values to updated resolved field
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field=field_name,
+                                        expression='!temp!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field='temp')
+            
+        # making sure ID is the field type long        
+        elif target_type == 'Long':
+            logger.info('')
+            logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
+            logger.info('transferring values to new fields...')
+            ### using this tool to transfer the vales to a long format
+            logger.info('creating temp field with the long format...')
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name='temp',
+                                              field_type='Long',
+                                              field_precision='',
+                                              field_scale='',
+                                              field_length='',
+                                              field_alias='')
+            ### replace blank values or strings with null
+            logger.info('replacing blank values and strings with nulls as it causes an error with conversions...')
+            codeblock = """def fixID(id):
+                    if isinstance(id, basestring):
+                        return None
+                    elif id == '':
+                        return None
+                    else:
+                        return int(id)
+                    """
+            ### copy cleaned values to a temp field
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field='temp',
+                                        expression='fixID(!ID!)',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=codeblock)
+            logger.info('deleting original field...')
+            ### delete the original field which has the incorrect schema
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field=field_name)
+            logger.info('add original field with updated schema...')
+            ### re-add schema updated field a copy values over
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name=field_name,
+                                              field_type='Long',
+                                              field_precision='',
+                                              field_scale='',
+                                              field_length='',
+                                              field_alias=field_name_alias_updated)
+            logger.info('copying values to updated original field...')
+            ### copy values to updated resolved field
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field=field_name,
+                                        expression='!temp!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field='temp')
+            
+        ### the following is used to make the numeric fields all doubles
+        elif target_type == 'Double':
+            ### using this tool to transfer the vales from a string to a standard date format
+            logger.info('')
+            logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
+            logger.info('creating a temp Double field...')
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name='temp',
+                                              field_type='Double',
+                                              field_precision='9',
+                                              field_scale='6',
+                                              field_length='',
+                                              field_alias='')
+            ### copy values to temp field
+            logger.info('copying values to temp field...')
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field='temp',
+                                        expression='!' + field_name + '!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+            logger.info('deleting original field...')
+            ### delete the original field which has the incorrect schema
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field=field_name)
+            logger.info('add original field with updated schema...')
+            ### re-add schema updated field a copy values over
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name=field_name,
+                                              field_type='Double',
+                                              field_precision='9',
+                                              field_scale='6',
+                                              field_length='',
+                                              field_alias=field_name_alias_updated)
+            logger.info('copying values to updated original field...')
+            ### copy values to updated resolved field
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field=field_name,
+                                        expression='!temp!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field='temp')
+
+        ### the following is used to make check if a field is the correct type
+        elif target_type == 'String':
+            field_length = returnFieldDefinition(field_name)[3]
+            ### using this tool to transfer the vales from one type to another
+            logger.info('')
+            logger.info('field name is : {0} and field type is: {1}'.format(field_name, field_type))
+            logger.info('converting the field to another type...')
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name='temp',
+                                              field_type='String',
+                                              field_precision='',
+                                              field_scale='',
+                                              field_length=field_length,
+                                              field_alias='')
+            ### copy values to temp field
+            logger.info('copying values to temp field...')
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field='temp',
+                                        expression='!' + field_name + '!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+            logger.info('deleting original field...')
+            ### delete the original field which has the incorrect schema
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field=field_name)
+            logger.info('add original field with updated schema...')
+            ### re-add schema updated field a copy values over
+            arcpy.AddField_management(in_table=output_temp,
+                                              field_name=field_name,
+                                              field_type='String',
+                                              field_precision='',
+                                              field_scale='',
+                                              field_length=field_length,
+                                              field_alias=field_name_alias_updated)
+            logger.info('copying values to updated original field...')
+            ### copy values to updated field
+            arcpy.CalculateField_management(in_table=output_temp,
+                                        field=field_name,
+                                        expression='!temp!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+            # delete temp field
+            arcpy.DeleteField_management (in_table=output_temp,
+                                      drop_field='temp')
+
+    # create new comments actions required field and copy values from original field
+    #  the original field will be removed in fieldsToDelete function
+    for source_field, target_field in plan['copy']:
+        arcpy.CalculateField_management(in_table=output_temp,
+                                        field=target_field,
+                                        expression='!' + source_field + '!',
+                                        expression_type='PYTHON_9.3',
+                                        code_block=None)
+
+
+# ------------------------------------------------
+# rules every row must pass before it is appended, rows that fail go to the rejects table
+# ------------------------------------------------
+def returnValidationRules():
+    # range rules skip blank values, Latitude and Longitude are in the output coordinate system
+    australia = returnAustraliaBounds()
+    rules = [
+        {'rule': 'KP out of range', 'type': 'range', 'field': 'KP', 'min': 0.0, 'max': 3000.0},
+        {'rule': 'Latitude outside Australia', 'type': 'range', 'field': 'Latitude',
+         'min': australia['latitude'][0], 'max': australia['latitude'][1]},
+        {'rule': 'Longitude outside Australia', 'type': 'range', 'field': 'Longitude',
+         'min': australia['longitude'][0], 'max': australia['longitude'][1]},
+        {'rule': 'Observation date in the future', 'type': 'not_future', 'field': 'Observation_Date'},
+        {'rule': 'Resolved date in the future', 'type': 'not_future', 'field': 'Resolved_Date'},
+        {'rule': 'Resolved before observed', 'type': 'not_before', 'field': 'Resolved_Date',
+         'other': 'Observation_Date'},
+    ]
+    return rules
+
+
+# ------------------------------------------------
+# create the table that failed rows are written to, with where they came from and why. rows hold the
+# source file id like the output table, so a workbook's rejects are deleted with its rows
+# ------------------------------------------------
+def createRejectsTable(output_gdb, table_name):
+    arcpy.CreateTable_management (output_gdb, table_name)
+    DIC_field_names_type = {
+            1: ['Source_File_ID', 'SHORT', '', '', '', 'Source File ID'],
+            2: ['Source_Row', 'LONG', '', '', '', 'Source Row'],
+            3: ['Rule', 'TEXT', '', '', '100', 'Rule'],
+            4: ['Field_Name', 'TEXT', '', '', '50', 'Field Name'],
+            5: ['Field_Value', 'TEXT', '', '', '255', 'Field Value']
+    }
+    for key, value in sorted(DIC_field_names_type.items()):
+        arcpy.AddField_management(in_table=output_gdb + table_name,
+                                  field_name=value[0],
+                                  field_type=value[1],
+                                  field_precision=value[2],
+                                  field_scale=value[3],
+                                  field_length=value[4],
+                                  field_alias=value[5])
+
+
+# ------------------------------------------------
+# turns a column of values into a float array, blanks and values that can't be read become nan
+# ------------------------------------------------
+def columnToFloat(values):
+    column = numpy.empty(len(values), dtype=numpy.float64)
+    for i, value in enumerate(values):
+        try:
+            column[i] = float(value)
+        except (TypeError, ValueError):
+            column[i] = numpy.nan
+    return column
+
+
+# ------------------------------------------------
+# turns a column of dates into seconds since 1970 so they can be compared as a float array
+# ------------------------------------------------
+def dateColumnToFloat(values):
+    epoch = datetime.datetime(1970, 1, 1)
+    column = numpy.empty(len(values), dtype=numpy.float64)
+    for i, value in enumerate(values):
+        if isinstance(value, datetime.datetime):
+            column[i] = (value - epoch).total_seconds()
+        else:
+            column[i] = numpy.nan
+    return column
+
+
+# ------------------------------------------------
+# runs every rule over whole columns at once, returns the rule and a mask of the rows that failed it
+# ------------------------------------------------
+def evaluateRules(arrays, rules, now):
+    results = []
+    for rule in rules:
+        column = arrays[rule['field']]
+        # comparisons with nan are always false, so blank values never fail a rule
+        with numpy.errstate(invalid='ignore'):
+            if rule['type'] == 'range':
+                failed = (column < rule['min']) | (column > rule['max'])
+            elif rule['type'] == 'not_future':
+                failed = column > now
+            elif rule['type'] == 'not_before':
+                failed = column < arrays[rule['other']]
+            else:
+                raise ValueError('unknown validation rule type: ' + rule['type'])
+        results.append([rule, failed])
+    return results
+
+
+# ------------------------------------------------
+# runs the validation rules over a batch, drops the rows that fail and adds their rejects table rows to
+# the batch, they are written with the batch's rows
+# ------------------------------------------------
+def rejectRows(batch, rules):
+    # the rules work on whole columns, so the rows are turned into columns first
+    columns = dict(zip(batch['fields'], zip(*batch['rows'])))
+    kp = columns['KP']
+    observation_date = columns['Observation_Date']
+    resolved_date = columns['Resolved_Date']
+    # the lat/long and coordinate stages have already split the locations into the output coordinate system
+    latitude = columns['Latitude']
+    longitude = columns['Longitude']
+
+    arrays = {'KP': columnToFloat(kp),
+              'Latitude': columnToFloat(latitude),
+              'Longitude': columnToFloat(longitude),
+              'Observation_Date': dateColumnToFloat(observation_date),
+              'Resolved_Date': dateColumnToFloat(resolved_date)}
+    values = {'KP': kp, 'Latitude': latitude, 'Longitude': longitude,
+              'Observation_Date': observation_date, 'Resolved_Date': resolved_date}
+    now = dateColumnToFloat([datetime.datetime.now()])[0]
+
+    # a rejects row for every rule a row failed
+    rejected = set()
+    for rule, failed in evaluateRules(arrays, rules, now):
+        failed_rows = numpy.nonzero(failed)[0]
+        if len(failed_rows):
+            logger.info('%s rows failed the rule: %s', len(failed_rows), rule['rule'])
+        for i in failed_rows:
+            batch['rejects'].append([batch['source_id'], batch['row_numbers'][i], rule['rule'], rule['field'],
+                                     u'{0}'.format(values[rule['field']][i])[:255]])
+            rejected.add(i)
+
+    if rejected:
+        batch['rows'] = [row for i, row in enumerate(batch['rows']) if i not in rejected]
+        batch['row_numbers'] = [number for i, number in enumerate(batch['row_numbers']) if i not in rejected]
+    logger.info('%s of %s rows were rejected', len(rejected), len(rejected) + len(batch['rows']))
+    return len(rejected)
+
+
+# ------------------------------------------------
+# the latitudes and longitudes of Australia, used by the validation rules and to spot swapped locations
+# ------------------------------------------------
+def returnAustraliaBounds():
+    DIC_australia_bounds = {
+        'latitude': (-44.0, -9.0),
+        'longitude': (112.0, 154.0),
+    }
+    return DIC_australia_bounds
+
+
+# ------------------------------------------------
+# splits location values into latitude and longitude, returns a (latitude, longitude) for each value or
+# None when it can't be read. plain decimal pairs are read with float straight away and pairs that are
+# backwards for Australia are swapped. anything else goes through parseLocationText, once for each
+# different value
+# ------------------------------------------------
+def parseLocations(values):
+    australia = returnAustraliaBounds()
+    min_latitude, max_latitude = australia['latitude']
+    min_longitude, max_longitude = australia['longitude']
+    grammar = returnLocationGrammar()
+    parsed = {None: None}
+    points = []
+    append = points.append
+    text_types = (type(u''), str)
+    for value in values:
+        latitude = None
+        # float is only tried on text with a comma, raising errors for everything else is slow
+        if isinstance(value, text_types) and ',' in value:
+            first, comma, second = value.partition(',')
+            try:
+                latitude, longitude = float(first), float(second)
+            except ValueError:
+                latitude = None
+        if latitude is None:
+            if value not in parsed:
+                parsed[value] = parseLocationText(u'{0}'.format(value), grammar)
+            append(parsed[value])
+            continue
+        if min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude:
+            append((latitude, longitude))
+        elif latitude - latitude != 0 or longitude - longitude != 0:
+            # nan and infinity aren't locations
+            append(None)
+        elif min_latitude <= longitude <= max_latitude and min_longitude <= latitude <= max_longitude:
+            append((longitude, latitude))
+        else:
+            append((latitude, longitude))
+    return points
+
+
+# ------------------------------------------------
+# what parseLocationText reads locations with; the tokens, the unit and hemisphere words, and the usual ways
+# locations are written other than decimal pairs, matched whole by one regex each. those are latitude then
+# longitude in degrees and minutes with the symbols and seconds if there are any, and decimal degrees
+# labelled lat and long
+# ------------------------------------------------
+def returnLocationGrammar():
+    DIC_location_grammar = {
+        'tokens': re.compile(u'(?P<number>[-+\u2212]?(?:\\d+(?:\\.\\d*)?|\\.\\d+))|(?P<word>[^\\W\\d_]+)|'
+                             u'(?P<unit>[\u00b0\u00ba\u02da\'\u2019\u2032"\u201d\u2033])|(?P<separator>[,;/])|'
+                             u'(?P<space>[\\s:=()]+)|(?P<other>.)', re.UNICODE),
+        'units': {u'\u00b0': 'degrees', u'\u00ba': 'degrees', u'\u02da': 'degrees', u"'": 'minutes',
+                  u'\u2019': 'minutes', u'\u2032': 'minutes', u'"': 'seconds', u'\u201d': 'seconds',
+                  u'\u2033': 'seconds', u'deg': 'degrees', u'degrees': 'degrees', u'min': 'minutes',
+                  u'mins': 'minutes', u'minutes': 'minutes', u'sec': 'seconds', u'secs': 'seconds',
+                  u'seconds': 'seconds'},
+        # hemisphere letters set the axis and sign of a coordinate, labels only the axis
+        'words': {u'n': ['latitude', 1], u'north': ['latitude', 1], u's': ['latitude', -1],
+                  u'south': ['latitude', -1], u'e': ['longitude', 1], u'east': ['longitude', 1],
+                  u'w': ['longitude', -1], u'west': ['longitude', -1], u'lat': ['latitude', None],
+                  u'latitude': ['latitude', None], u'long': ['longitude', None], u'lon': ['longitude', None],
+                  u'lng': ['longitude', None], u'longitude': ['longitude', None]},
+        'degree': re.compile(
+            u'\\s*([NS]?)\\s*([-+]?\\d+)\\s*[\u00b0\u00ba\u02da]\\s*(\\d+(?:\\.\\d+)?)\\s*[\'\u2019\u2032]'
+            u'\\s*(?:(\\d+(?:\\.\\d+)?)\\s*(?:["\u201d\u2033]|\'\'))?\\s*([NS]?)\\s*[,;/]?'
+            u'\\s*([EW]?)\\s*([-+]?\\d+)\\s*[\u00b0\u00ba\u02da]\\s*(\\d+(?:\\.\\d+)?)\\s*[\'\u2019\u2032]'
+            u'\\s*(?:(\\d+(?:\\.\\d+)?)\\s*(?:["\u201d\u2033]|\'\'))?\\s*([EW]?)\\s*$',
+            re.IGNORECASE | re.UNICODE),
+        'labelled': re.compile(
+            u'\\s*lat(?:itude)?\\s*[:=]?\\s*([-+]?\\d+(?:\\.\\d+)?)\\s*[,;/]?'
+            u'\\s*(?:long|lon|lng|longitude)\\s*[:=]?\\s*([-+]?\\d+(?:\\.\\d+)?)\\s*$',
+            re.IGNORECASE | re.UNICODE),
+    }
+    return DIC_location_grammar
+
+
+# ------------------------------------------------
+# reads a location written any other way. the usual forms are matched whole first, anything else is
+# read in a single pass over its tokens; decimal degrees, degrees and decimal minutes or degrees,
+# minutes and seconds, with or without the symbols, hemisphere letters or lat/long labels, in either
+# order. returns (latitude, longitude) or None
+# ------------------------------------------------
+def parseLocationText(text, grammar):
+    match = grammar['degree'].match(text)
+    if match:
+        groups = match.groups()
+        north_south, east_west = (groups[0] + groups[4]).upper(), (groups[5] + groups[9]).upper()
+        latitude = degreeValue(groups[1], groups[2], groups[3], 'S' in north_south)
+        longitude = degreeValue(groups[6], groups[7], groups[8], 'W' in east_west)
+        if latitude is not None and longitude is not None:
+            if north_south or east_west:
+                return latitude, longitude
+            return orderForAustralia(latitude, longitude)
+    match = grammar['labelled'].match(text)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+
+    groups = [{'numbers': [], 'units': [], 'axis': None, 'sign': None, 'closed': False}]
+    last_kind, last_end = None, 0
+    units, words = grammar['units'], grammar['words']
+    for match in grammar['tokens'].finditer(text):
+        kind, token = match.lastgroup, match.group()
+        if kind == 'word' and token.lower() in units:
+            kind, token = 'unit', token.lower()
+        current = groups[-1]
+        if kind == 'other' or (kind == 'number' and last_kind == 'number' and match.start() == last_end):
+            # stray characters, or numbers run together like 26.0.1
+            return None
+        elif kind == 'number':
+            if current['closed']:
+                current = newLocationGroup(groups)
+            current['numbers'].append(float(token.replace(u'\u2212', u'-')))
+            current['units'].append(None)
+        elif kind == 'unit':
+            if not current['numbers']:
+                return None
+            unit = units[token]
+            # two minute marks are a second mark
+            if unit == 'minutes' and last_kind == 'unit' and current['units'][-1] == 'minutes':
+                unit = 'seconds'
+            current['units'][-1] = unit
+            # a second number marked as degrees starts the other coordinate
+            if unit == 'degrees' and len(current['numbers']) > 1:
+                number = current['numbers'].pop()
+                current['units'].pop()
+                following = newLocationGroup(groups)
+                following['numbers'].append(number)
+                following['units'].append(unit)
+        elif kind == 'separator':
+            current['closed'] = bool(current['numbers'])
+        elif kind == 'word':
+            if token.lower() not in words:
+                return None
+            axis, sign = words[token.lower()]
+            if current['numbers'] and sign is not None and current['sign'] is None and current['axis'] in (None, axis):
+                # a hemisphere after the numbers, such as 26.0S
+                current['axis'], current['sign'], current['closed'] = axis, sign, True
+            else:
+                if current['numbers'] or current['axis'] is not None:
+                    current = newLocationGroup(groups)
+                current['axis'], current['sign'] = axis, sign
+        if kind != 'space':
+            last_kind, last_end = kind, match.end()
+
+    groups = [group for group in groups if group['numbers']]
+    if len(groups) == 1 and groups[0]['axis'] is None and len(groups[0]['numbers']) in (2, 4, 6) \
+            and not any(groups[0]['units']):
+        # numbers only split by spaces, half of them for each coordinate
+        numbers = groups[0]['numbers']
+        half = len(numbers) // 2
+        groups = [{'numbers': numbers[:half], 'units': [None] * half, 'axis': None, 'sign': None},
+                  {'numbers': numbers[half:], 'units': [None] * half, 'axis': None, 'sign': None}]
+    if len(groups) != 2:
+        return None
+    values = [locationGroupValue(group) for group in groups]
+    if None in values:
+        return None
+
+    axes = [group['axis'] for group in groups]
+    if axes[0] == axes[1] and axes[0] is not None:
+        return None
+    if axes[0] == 'longitude' or axes[1] == 'latitude':
+        return values[1], values[0]
+    if axes[0] is None and axes[1] is None:
+        return orderForAustralia(values[0], values[1])
+    return values[0], values[1]
+
+
+# ------------------------------------------------
+# swaps a latitude and longitude that are only inside Australia the other way around
+# ------------------------------------------------
+def orderForAustralia(latitude, longitude):
+    australia = returnAustraliaBounds()
+    min_latitude, max_latitude = australia['latitude']
+    min_longitude, max_longitude = australia['longitude']
+    if not (min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude) \
+            and min_latitude <= longitude <= max_latitude and min_longitude <= latitude <= max_longitude:
+        return longitude, latitude
+    return latitude, longitude
+
+
+# ------------------------------------------------
+# the decimal degrees of a coordinate matched by the degree location regex, or None if the minutes or seconds
+# are 60 or more
+# ------------------------------------------------
+def degreeValue(degrees, minutes, seconds, south_or_west):
+    minutes = float(minutes)
+    seconds = float(seconds) if seconds else 0.0
+    if minutes >= 60 or seconds >= 60:
+        return None
+    value = abs(float(degrees)) + minutes / 60 + seconds / 3600
+    return -value if south_or_west or degrees[0] == '-' else value
+
+
+def newLocationGroup(groups):
+    groups.append({'numbers': [], 'units': [], 'axis': None, 'sign': None, 'closed': False})
+    return groups[-1]
+
+
+# ------------------------------------------------
+# the decimal degrees of one coordinate from its degrees, minutes and seconds
+# ------------------------------------------------
+def locationGroupValue(group):
+    numbers = group['numbers']
+    if len(numbers) > 3 or any(number < 0 or number >= 60 for number in numbers[1:]):
+        return None
+    # units given have to be in order, degrees then minutes then seconds
+    expected = ['degrees', 'minutes', 'seconds'][:len(numbers)]
+    if any(unit is not None and unit != expected[i] for i, unit in enumerate(group['units'])):
+        return None
+    value = sum(abs(number) / 60.0 ** i for i, number in enumerate(numbers))
+    negative = math.copysign(1.0, numbers[0]) < 0 or group['sign'] == -1
+    return -value if negative else value
+
+
+# ------------------------------------------------
+# the datums locations can be in, with the code of their latitude/longitude coordinate system and the
+# number their grid zone is added to for the code of the grid, such as 28355 for MGA94 zone 55
+# ------------------------------------------------
+def returnDatums():
+    DIC_datums = {
+        'GDA94': {'code': 4283, 'grid': 28300},
+        'GDA2020': {'code': 7844, 'grid': 7800},
+        # WGS84 is within a metre or so of GDA2020 in Australia, so without pyproj it is taken as GDA2020
+        'WGS84': {'code': 4326, 'grid': 32700},
+    }
+    return DIC_datums
+
+
+# ------------------------------------------------
+# moves the latitude and longitude of a batch from the source_crs datum into the datum of the feature
+# class. pairs that are an easting and northing are read as MGA coordinates in mga_zone first. rows
+# with the default location are already in the output coordinate system and are left alone. returns
+# the number of rows that were moved
+# ------------------------------------------------
+def transformLocations(batch, context):
+    variables = context['variables']
+    rows = batch['rows']
+    location = batch['fields'].index('Location')
+    latitude = batch['fields'].index('Latitude')
+    longitude = batch['fields'].index('Longitude')
+    source, target = variables['source_crs'], variables['target_crs']
+    zone = variables['mga_zone']
+
+    located = [row[location] != variables['default_location'] for row in rows]
+    first = columnToFloat([row[latitude] if is_located else None for row, is_located in zip(rows, located)])
+    second = columnToFloat([row[longitude] if is_located else None for row, is_located in zip(rows, located)])
+    # comparisons with nan are false, so blank locations are in neither group
+    with numpy.errstate(invalid='ignore'):
+        geographic = (numpy.abs(first) <= 90) & (numpy.abs(second) <= 180)
+        easting_first = (first >= 100000) & (first < 1000000) & (second >= 1000000) & (second < 10000000)
+        northing_first = (second >= 100000) & (second < 1000000) & (first >= 1000000) & (first < 10000000)
+    grid = easting_first | northing_first
+
+    new_latitude = numpy.copy(first)
+    new_longitude = numpy.copy(second)
+    if source != target and geographic.any():
+        new_latitude[geographic], new_longitude[geographic] = transformCoordinates(
+            context, first[geographic], second[geographic], returnDatums()[source]['code'],
+            variables['spatial_reference'])
+    if grid.any() and zone == 0:
+        # left as they are, so the rules reject them as outside Australia
+        logger.info('%s easting/northing locations in %s can not be placed, set mga_zone to read them',
+                    int(grid.sum()), batch['xlsx'])
+        grid[:] = False
+    elif grid.any():
+        easting = numpy.where(easting_first, first, second)[grid]
+        northing = numpy.where(easting_first, second, first)[grid]
+        new_latitude[grid], new_longitude[grid] = transformCoordinates(
+            context, northing, easting, returnDatums()[source]['grid'] + zone, variables['spatial_reference'])
+        logger.info('%s locations in %s read as MGA zone %s eastings/northings', int(grid.sum()), batch['xlsx'],
+                    zone)
+
+    moved = (geographic & (source != target)) | grid
+    for i in numpy.nonzero(moved)[0]:
+        rows[i][latitude] = float(new_latitude[i])
+        rows[i][longitude] = float(new_longitude[i])
+    return int(moved.sum())
+
+
+# ------------------------------------------------
+# moves coordinates from one coordinate system to another a column at a time. uses pyproj when it is
+# installed, otherwise the GDA94/GDA2020 Helmert transformation and MGA grid formulas below, which only
+# know the coordinate systems in returnDatums. coordinates are latitude/longitude, or northing/easting
+# for a grid
+# ------------------------------------------------
+def transformCoordinates(context, first, second, source_code, target_code):
+    transformers = context.setdefault('transformers', {})
+    key = (source_code, target_code)
+    if key not in transformers:
+        try:
+            import pyproj
+            transformer = pyproj.Transformer.from_crs(source_code, target_code, always_xy=True)
+            transformers[key] = lambda first, second: transformer.transform(second, first)[::-1]
+        except ImportError:
+            transformers[key] = lambda first, second: transformHelmert(first, second, source_code, target_code)
+    new_first, new_second = transformers[key](numpy.asarray(first, dtype=numpy.float64),
+                                              numpy.asarray(second, dtype=numpy.float64))
+    return numpy.asarray(new_first), numpy.asarray(new_second)
+
+
+def transformHelmert(first, second, source_code, target_code):
+    datums = returnDatums()
+    source, target, zone = None, None, None
+    for name, datum in datums.items():
+        if datum['code'] == target_code:
+            target = name
+        if datum['code'] == source_code:
+            source = name
+    # a grid code is the datum's grid number plus the zone, 7844 is GDA2020 itself and not a zone
+    for name, datum in datums.items():
+        if source is None and datum['grid'] < source_code < datum['grid'] + 100:
+            source, zone = name, source_code - datum['grid']
+    if source is None or target is None:
+        raise ValueError('without pyproj only {0} can be transformed'.format(sorted(datums)))
+    if zone is not None:
+        first, second = gridToGeographic(second, first, zone)
+    # GDA2020 and WGS84 are taken as the same datum
+    source_is_gda94, target_is_gda94 = source == 'GDA94', target == 'GDA94'
+    if source_is_gda94 == target_is_gda94:
+        return first, second
+    x, y, z = geographicToCartesian(first, second)
+    x, y, z = helmertGDA94ToGDA2020(x, y, z, inverse=target_is_gda94)
+    return cartesianToGeographic(x, y, z)
+
+
+# ------------------------------------------------
+# GRS80, the ellipsoid of both GDA94 and GDA2020; the semi-major axis in metres and the flattening
+# ------------------------------------------------
+def returnEllipsoid():
+    DIC_ellipsoid = {
+        'a': 6378137.0,
+        'f': 1 / 298.257222101,
+    }
+    return DIC_ellipsoid
+
+
+def geographicToCartesian(latitude, longitude):
+    ellipsoid = returnEllipsoid()
+    e2 = ellipsoid['f'] * (2 - ellipsoid['f'])
+    phi, lam = numpy.radians(latitude), numpy.radians(longitude)
+    nu = ellipsoid['a'] / numpy.sqrt(1 - e2 * numpy.sin(phi) ** 2)
+    return (nu * numpy.cos(phi) * numpy.cos(lam), nu * numpy.cos(phi) * numpy.sin(lam),
+            nu * (1 - e2) * numpy.sin(phi))
+
+
+def cartesianToGeographic(x, y, z):
+    ellipsoid = returnEllipsoid()
+    e2 = ellipsoid['f'] * (2 - ellipsoid['f'])
+    p = numpy.sqrt(x ** 2 + y ** 2)
+    phi = numpy.arctan2(z, p * (1 - e2))
+    # a few rounds are well under a millimetre at the surface
+    for i in range(4):
+        nu = ellipsoid['a'] / numpy.sqrt(1 - e2 * numpy.sin(phi) ** 2)
+        phi = numpy.arctan2(z + e2 * nu * numpy.sin(phi), p)
+    return numpy.degrees(phi), numpy.degrees(numpy.arctan2(y, x))
+
+
+# ------------------------------------------------
+# the 7 parameter transformation from GDA94 to GDA2020 in the GDA2020 technical manual, coordinate frame
+# rotations. the inverse uses the same parameters with the signs changed
+# ------------------------------------------------
+def helmertGDA94ToGDA2020(x, y, z, inverse=False):
+    sign = -1.0 if inverse else 1.0
+    arc_seconds = numpy.pi / (180 * 3600)
+    tx, ty, tz = sign * 0.06155, sign * -0.01087, sign * -0.04019
+    rx, ry, rz = [sign * value * arc_seconds for value in (-0.0394924, -0.0327221, -0.0328979)]
+    scale = 1 + sign * -0.009994e-6
+    return (tx + scale * (x + rz * y - ry * z),
+            ty + scale * (-rz * x + y + rx * z),
+            tz + scale * (ry * x - rx * y + z))
+
+
+# ------------------------------------------------
+# MGA eastings/northings to latitude/longitude on the same datum, the transverse mercator series in
+# Kruger's form which is good to well under a millimetre inside a zone
+# ------------------------------------------------
+def gridToGeographic(easting, northing, zone):
+    ellipsoid = returnEllipsoid()
+    n = ellipsoid['f'] / (2 - ellipsoid['f'])
+    rectifying_radius = ellipsoid['a'] / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    beta = [n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96, n ** 2 / 48 + n ** 3 / 15, 17 * n ** 3 / 480]
+    delta = [2 * n - 2 * n ** 2 / 3 - 2 * n ** 3, 7 * n ** 2 / 3 - 8 * n ** 3 / 5, 56 * n ** 3 / 15]
+    xi = (numpy.asarray(northing) - 10000000.0) / (0.9996 * rectifying_radius)
+    eta = (numpy.asarray(easting) - 500000.0) / (0.9996 * rectifying_radius)
+    xi_prime, eta_prime = xi.copy(), eta.copy()
+    for j, b in enumerate(beta, 1):
+        xi_prime -= b * numpy.sin(2 * j * xi) * numpy.cosh(2 * j * eta)
+        eta_prime -= b * numpy.cos(2 * j * xi) * numpy.sinh(2 * j * eta)
+    chi = numpy.arcsin(numpy.sin(xi_prime) / numpy.cosh(eta_prime))
+    latitude = chi.copy()
+    for j, d in enumerate(delta, 1):
+        latitude += d * numpy.sin(2 * j * chi)
+    longitude = numpy.radians(zone * 6 - 183) + numpy.arctan2(numpy.sinh(eta_prime), numpy.cos(xi_prime))
+    return numpy.degrees(latitude), numpy.degrees(longitude)
+
+
+# ------------------------------------------------
+# reads the pipeline centrelines into lists of [name, KP at the start, points], in the output coordinate
+# system. each part of a multipart line is its own line
+# ------------------------------------------------
+def loadCentrelines(variables):
+    fields = ['OID@', 'SHAPE@']
+    for field_name in [variables['centreline_name_field'], variables['centreline_kp_field']]:
+        if field_name:
+            fields.append(field_name)
+    lines = []
+    logger.info('loading pipeline centrelines from %s...', variables['centreline_fc'])
+    with arcpy.da.SearchCursor(variables['centreline_fc'], fields,
+                               spatial_reference=arcpy.SpatialReference(variables['spatial_reference'])) as cursor:
+        for row in cursor:
+            values = dict(zip(fields, row))
+            name = values.get(variables['centreline_name_field'], row[0])
+            start_kp = values.get(variables['centreline_kp_field']) or 0.0
+            if row[1] is None:
+                continue
+            for part in row[1]:
+                points = [(point.Y, point.X) for point in part if point is not None]
+                if len(points) > 1:
+                    lines.append([u'{0}'.format(name), float(start_kp), points])
+    logger.info('%s centreline parts loaded', len(lines))
+    return lines
+
+
+# ------------------------------------------------
+# metres in a degree of latitude, distances are worked out on a plane with longitude scaled by the cosine
+# of the latitude, which is close enough over the length of a segment or the offset of a point
+# ------------------------------------------------
+def returnMetresPerDegree():
+    return 6371008.8 * math.pi / 180
+
+
+# ------------------------------------------------
+# the distance in metres along a line to each of its points
+# ------------------------------------------------
+def lineChainages(points):
+    metres_per_degree = returnMetresPerDegree()
+    chainages = [0.0]
+    for (lat1, lon1), (lat2, lon2) in zip(points[:-1], points[1:]):
+        scale = math.cos(math.radians((lat1 + lat2) / 2))
+        chainages.append(chainages[-1] + math.hypot((lon2 - lon1) * scale, lat2 - lat1) * metres_per_degree)
+    return chainages
+
+
+# ------------------------------------------------
+# builds the KP lookup of each pipeline; its name folded like a header -> the KP, latitude and longitude
+# of the points of each of its parts, so a KP is placed by interpolating between two points
+# ------------------------------------------------
+def buildKpIndex(lines):
+    kp_index = {}
+    for name, start_kp, points in lines:
+        kps = start_kp + numpy.array(lineChainages(points)) / 1000
+        latitudes, longitudes = [numpy.array(column) for column in zip(*points)]
+        kp_index.setdefault(normaliseHeader(name), []).append([kps, latitudes, longitudes])
+    return kp_index
+
+
+# ------------------------------------------------
+# places rows without a location on their pipeline at their KP. the pipeline is the centreline named in
+# pipeline_field, or the only one when just one is loaded. returns the number of rows placed
+# ------------------------------------------------
+def imputeLocations(batch, kp_index, pipeline_field):
+    fields = batch['fields']
+    latitude = fields.index('Latitude')
+    longitude = fields.index('Longitude')
+    kp = fields.index('KP')
+    pipeline = fields.index(pipeline_field)
+    only_pipeline = list(kp_index.values())[0] if len(kp_index) == 1 else []
+    imputed = 0
+    for row in batch['rows']:
+        if row[latitude] is not None or row[kp] is None:
+            continue
+        parts = kp_index.get(normaliseHeader(u'{0}'.format(row[pipeline])), only_pipeline)
+        for kps, latitudes, longitudes in parts:
+            if kps[0] <= row[kp] <= kps[-1]:
+                row[latitude] = float(numpy.interp(row[kp], kps, latitudes))
+                row[longitude] = float(numpy.interp(row[kp], kps, longitudes))
+                imputed += 1
+                break
+    if imputed:
+        logger.info('%s rows in %s without a location were placed from their KP', imputed, batch['xlsx'])
+    return imputed
+
+
+# ------------------------------------------------
+# builds the spatial index of centreline segments; a sort-tile-recursive packed R-tree of segment
+# bounding boxes, along with each segment's line, KP at its start and length in metres
+# ------------------------------------------------
+def buildCentrelineIndex(lines, node_size=16):
+    segments, names, start_kps, lengths = [], [], [], []
+    for name, start_kp, points in lines:
+        chainages = lineChainages(points)
+        for i, ((lat1, lon1), (lat2, lon2)) in enumerate(zip(points[:-1], points[1:])):
+            segments.append((lon1, lat1, lon2, lat2))
+            names.append(name)
+            start_kps.append(start_kp + chainages[i] / 1000)
+            lengths.append(chainages[i + 1] - chainages[i])
+
+    # each entry is [min x, min y, max x, max y, child, is a segment]
+    entries = [[min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), i, True]
+               for i, (x1, y1, x2, y2) in enumerate(segments)]
+    nodes = []
+    while len(entries) > node_size:
+        # sort by x into vertical slices, then by y within each slice, and pack runs of entries into nodes
+        leaf_count = int(math.ceil(len(entries) / float(node_size)))
+        slice_size = int(math.ceil(math.sqrt(leaf_count))) * node_size
+        entries.sort(key=lambda entry: entry[0] + entry[2])
+        packed = []
+        for start in range(0, len(entries), slice_size):
+            tile = sorted(entries[start:start + slice_size], key=lambda entry: entry[1] + entry[3])
+            for node_start in range(0, len(tile), node_size):
+                children = tile[node_start:node_start + node_size]
+                nodes.append(children)
+                packed.append([min(child[0] for child in children), min(child[1] for child in children),
+                               max(child[2] for child in children), max(child[3] for child in children),
+                               len(nodes) - 1, False])
+        entries = packed
+    nodes.append(entries)
+    logger.info('centreline index built over %s segments', len(segments))
+    return {'nodes': nodes, 'root': len(nodes) - 1, 'segments': segments, 'names': names,
+            'start_kps': start_kps, 'lengths': lengths}
+
+
+# ------------------------------------------------
+# finds the segment nearest a point, nearest boxes first, and stops looking once everything left is
+# further than max_offset metres. returns the segment, how far along it the point is from 0 to 1 and
+# the offset in metres, or None when no segment is that close
+# ------------------------------------------------
+def nearestSegment(index, latitude, longitude, max_offset):
+    metres_per_degree = returnMetresPerDegree()
+    scale = math.cos(math.radians(latitude))
+    limit = (max_offset / metres_per_degree) ** 2
+    nodes, segments = index['nodes'], index['segments']
+    heap = [(0.0, index['root'], False)]
+    while heap:
+        distance, item, is_segment = heapq.heappop(heap)
+        if is_segment:
+            # every box and segment left on the heap is at least as far away
+            x1, y1, x2, y2 = segments[item]
+            return item, segmentPosition(longitude, latitude, x1, y1, x2, y2, scale)[0], \
+                math.sqrt(distance) * metres_per_degree
+        for min_x, min_y, max_x, max_y, child, child_is_segment in nodes[item]:
+            if child_is_segment:
+                x1, y1, x2, y2 = segments[child]
+                child_distance = segmentPosition(longitude, latitude, x1, y1, x2, y2, scale)[1]
+            else:
+                dx = (min_x - longitude if longitude < min_x else longitude - max_x if longitude > max_x else 0.0)
+                dy = (min_y - latitude if latitude < min_y else latitude - max_y if latitude > max_y else 0.0)
+                child_distance = (dx * scale) ** 2 + dy ** 2
+            if child_distance <= limit:
+                heapq.heappush(heap, (child_distance, child, child_is_segment))
+    return None
+
+
+def segmentPosition(x, y, x1, y1, x2, y2, scale):
+    dx, dy = (x2 - x1) * scale, y2 - y1
+    length = dx * dx + dy * dy
+    along = 0.0 if length == 0 else max(0.0, min(1.0, ((x - x1) * scale * dx + (y - y1) * dy) / length))
+    return along, ((x1 + along * (x2 - x1) - x) * scale) ** 2 + (y1 + along * dy - y) ** 2
+
+
+# ------------------------------------------------
+# fills the centreline fields of a batch, points further than max_offset metres from every centreline
+# are flagged. returns the number flagged
+# ------------------------------------------------
+def snapLocations(batch, index, default_location, max_offset):
+    fields = batch['fields']
+    location = fields.index('Location')
+    latitude = fields.index('Latitude')
+    longitude = fields.index('Longitude')
+    pipeline = fields.index('Pipeline_Name')
+    centreline_kp = fields.index('Centreline_KP')
+    offset = fields.index('Centreline_Offset')
+    off_centreline = fields.index('Off_Centreline')
+    flagged = 0
+    for row in batch['rows']:
+        # the default point isn't a real location, so it isn't snapped or flagged
+        if row[location] == default_location or row[latitude] is None or row[longitude] is None:
+            continue
+        nearest = nearestSegment(index, row[latitude], row[longitude], max_offset)
+        if nearest is None:
+            row[off_centreline] = 'Yes'
+            flagged += 1
+            continue
+        segment, along, distance = nearest
+        row[pipeline] = index['names'][segment]
+        row[centreline_kp] = index['start_kps'][segment] + along * index['lengths'][segment] / 1000
+        row[offset] = distance
+        row[off_centreline] = 'No'
+    if flagged:
+        logger.info('%s points in %s are more than %s metres from a pipeline', flagged, batch['xlsx'], max_offset)
+    return flagged
+
+
+# ------------------------------------------------
+# returns the modified time and size of every workbook in a folder
+# ------------------------------------------------
+def folderSnapshot(input_folder):
+    snapshot = {}
+    for xlsx in listWorkbooks(input_folder):
+        try:
+            stat = os.stat(os.path.join(input_folder, xlsx))
+        except OSError:
+            # the file was removed between listing the folder and reading it
+            continue
+        snapshot[xlsx] = [stat.st_mtime, stat.st_size]
+    return snapshot
+
+
+# ------------------------------------------------
+# the run lock; a lease file next to the geodatabase so only one run writes to it at a time. the file's
+# modified time is the heartbeat, renewed by a thread while the lock is held. a lock that hasn't been
+# renewed for lock_lease_seconds was left by a run that died and is taken over. waits up to
+# lock_wait_seconds for another run to finish, returns the lock or None if it is still held
+# ------------------------------------------------
+def acquireRunLock(variables, command):
+    lock_file = variables['lock_file']
+    lease = variables['lock_lease_seconds']
+    owner = '{0}:{1}:{2:012x}'.format(socket.gethostname(), os.getpid(), random.getrandbits(48))
+    give_up = time.time() + variables['lock_wait_seconds']
+    waiting = False
+    denied = False
+    while True:
+        try:
+            handle = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            # windows gives access denied for a lock file that is being deleted
+            if e.errno not in (errno.EEXIST, errno.EACCES):
+                raise
+            error = e
+        else:
+            with os.fdopen(handle, 'w') as f:
+                json.dump({'owner': owner, 'command': command,
+                           'started': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+            break
+        try:
+            holder = readRunLock(lock_file)
+        except (IOError, OSError) as e:
+            # it is there but can't be read, such as while it is being written, so it is taken as held
+            logger.info('could not read the run lock %s: %s', lock_file, repr(e))
+            holder = {}
+        if holder is None:
+            # released between trying to create it and reading it, or being deleted. access denied again
+            # with no lock file in the way means the folder can't be written to
+            if error.errno == errno.EACCES:
+                if denied:
+                    raise error
+                denied = True
+                time.sleep(0.1)
+            continue
+        denied = False
+        # the modified time comes from the clock of the machine that renewed it, so the lease needs to be
+        # well over any difference between the clocks of the machines sharing the geodatabase
+        if 'heartbeat' in holder and time.time() - holder['heartbeat'] > lease:
+            logger.info('the run lock held by %s has not been renewed for %.0f seconds, taking it over',
+                        holder.get('owner'), time.time() - holder['heartbeat'])
+            breakStaleLock(lock_file, holder)
+            continue
+        if time.time() >= give_up:
+            logger.info('%s is held by %s running %s since %s', lock_file, holder.get('owner'),
+                        holder.get('command'), holder.get('started'))
+            return None
+        if not waiting:
+            logger.info('waiting up to %s seconds for %s to finish...', variables['lock_wait_seconds'],
+                        holder.get('owner'))
+            waiting = True
+        time.sleep(min(5.0, max(give_up - time.time(), 0.1)))
+
+    lock = {'file': lock_file, 'owner': owner, 'lease': lease, 'stop': threading.Event(),
+            'lost': threading.Event()}
+    lock['thread'] = threading.Thread(target=heartbeatRunLock, args=(lock,))
+    lock['thread'].daemon = True
+    lock['thread'].start()
+    logger.info('run lock %s taken as %s', lock_file, owner)
+    return lock
+
+
+# ------------------------------------------------
+# returns the contents of a lock file with its modified time as the heartbeat, or None if there isn't one.
+# raises IOError or OSError if it is there but can't be read
+# ------------------------------------------------
+def readRunLock(lock_file):
+    try:
+        heartbeat = os.stat(lock_file).st_mtime
+        with open(lock_file, 'r') as f:
+            holder = json.load(f)
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    except ValueError:
+        # the run taking it hasn't written it yet
+        holder = {}
+    holder['heartbeat'] = heartbeat
+    return holder
+
+
+# ------------------------------------------------
+# moves a stale lock out of the way. it is renamed first, so if another run took it over after it was
+# read the new lock is put back instead of being deleted
+# ------------------------------------------------
+def breakStaleLock(lock_file, holder):
+    stale_file = '{0}.{1:012x}.stale'.format(lock_file, random.getrandbits(48))
+    try:
+        os.rename(lock_file, stale_file)
+    except OSError:
+        # another run moved it first
+        return
+    try:
+        moved = readRunLock(stale_file)
+    except (IOError, OSError):
+        # it was read as stale a moment ago, so it is removed
+        moved = None
+    if moved is not None and moved.get('owner') != holder.get('owner'):
+        try:
+            os.rename(stale_file, lock_file)
+        except OSError:
+            logger.info('could not put back the run lock of %s', moved.get('owner'))
+        return
+    os.remove(stale_file)
+
+
+# ------------------------------------------------
+# renews the lock every third of the lease until it is released. stops and marks the lock lost if
+# another run has taken it, or it couldn't be read or renewed for a whole lease
+# ------------------------------------------------
+def heartbeatRunLock(lock):
+    renewed = time.time()
+    while not lock['stop'].wait(lock['lease'] / 3.0):
+        try:
+            holder = readRunLock(lock['file'])
+            # a lock file that is gone or names another run was taken over, one that can't be read is a
+            # problem with the share and is tried again
+            if holder is None or ('owner' in holder and holder['owner'] != lock['owner']):
+                logger.info('the run lock %s has been taken over by %s', lock['file'],
+                            holder.get('owner') if holder else 'another run')
+                lock['lost'].set()
+                return
+            if 'owner' not in holder:
+                raise IOError('the run lock {0} could not be read'.format(lock['file']))
+            os.utime(lock['file'], None)
+            renewed = time.time()
+        except (IOError, OSError) as e:
+            logger.info('could not renew the run lock: %s', repr(e))
+            if time.time() - renewed > lock['lease']:
+                logger.info('the run lock %s has not been renewed for a whole lease', lock['file'])
+                lock['lost'].set()
+                return
+
+
+# ------------------------------------------------
+# whether the run still holds its lock, or runs without one. once it is lost nothing more is written to
+# the geodatabase or the state files, checkRunLock stops the run
+# ------------------------------------------------
+def runLockHeld(context):
+    return context['lock'] is None or not context['lock']['lost'].is_set()
+
+
+def checkRunLock(context, before):
+    if not runLockHeld(context):
+        raise RuntimeError('the run lock {0} was lost, stopping before {1}'.format(context['lock']['file'], before))
+
+
+def releaseRunLock(lock):
+    lock['stop'].set()
+    lock['thread'].join()
+    try:
+        holder = readRunLock(lock['file'])
+    except (IOError, OSError) as e:
+        # left for its lease to run out, it can't be told apart from another run's
+        logger.info('could not read the run lock to release it: %s', repr(e))
+        return
+    if holder is not None and holder.get('owner') == lock['owner']:
+        os.remove(lock['file'])
+        logger.info('run lock %s released', lock['file'])
+
+
+# ------------------------------------------------
+# reads and writes the list of workbooks that have been loaded and the snapshot they were loaded at
+# ------------------------------------------------
+def loadIngestState(state_file):
+    if os.path.isfile(state_file):
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.info('ingest state %s could not be read, all workbooks will be loaded again', state_file)
+    return {}
+
+
+def saveIngestState(state_file, ingested):
+    with open(state_file, 'w') as f:
+        json.dump(ingested, f, indent=2, sort_keys=True)
+
+
+# ------------------------------------------------
+# reads and writes the quarantine list; the workbooks that failed by their content hash, with the workbook
+# name, the reason and when it failed. a changed workbook has a new hash so it is tried again
+# ------------------------------------------------
+def loadQuarantine(quarantine_file):
+    if os.path.isfile(quarantine_file):
+        try:
+            with open(quarantine_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.info('quarantine list %s could not be read, quarantined workbooks will be tried again',
+                        quarantine_file)
+    return {}
+
+
+def saveQuarantine(quarantine_file, quarantine):
+    with open(quarantine_file, 'w') as f:
+        json.dump(quarantine, f, indent=2, sort_keys=True)
+
+
+# ------------------------------------------------
+# reads and writes the number of times each workbook has been tried again, by its content hash
+# ------------------------------------------------
+def loadRetries(retries_file):
+    if os.path.isfile(retries_file):
+        try:
+            with open(retries_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.info('retry counts %s could not be read, starting them again', retries_file)
+    return {}
+
+
+def saveRetries(retries_file, retries):
+    with open(retries_file, 'w') as f:
+        json.dump(retries, f, indent=2, sort_keys=True)
+
+
+# ------------------------------------------------
+# reads and writes the manifest; the row count and checksum of each workbook in the output table and of
+# the whole table, and the fields the checksums are worked out from
+# ------------------------------------------------
+def loadManifest(manifest_file, acceptedFieldList):
+    manifest = {'fields': returnOutputFields(acceptedFieldList), 'files': {}}
+    if os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file, 'r') as f:
+                saved = json.load(f)
+            # checksums worked out from other fields can't be compared, so the workbooks are left out
+            if saved['fields'] == manifest['fields']:
+                manifest['files'] = saved['files']
+        except (ValueError, KeyError):
+            logger.info('manifest %s could not be read, starting a new one', manifest_file)
+    return manifest
+
+
+def saveManifest(manifest_file, manifest):
+    total = combineChecksums([[entry['rows'], int(entry['checksum'], 16)] for entry in manifest['files'].values()])
+    manifest['total'] = {'rows': total[0], 'checksum': '{0:016x}'.format(total[1])}
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+# ------------------------------------------------
+# saves the column plan cache, quarantine list and manifest kept in the merge context
+# ------------------------------------------------
+def saveContextState(context):
+    variables = context['variables']
+    savePlanCache(variables['plan_cache_file'], context['plan_cache'], variables['plan_cache_max_idle_runs'])
+    saveQuarantine(variables['quarantine_file'], context['quarantine'])
+    saveRetries(variables['retries_file'], context['retries'])
+    saveManifest(variables['manifest_file'], context['manifest'])
+
+
+# ------------------------------------------------
+# reads the column plan cache, quarantine list, manifest and source files into the merge context again,
+# for when another run may have changed them
+# ------------------------------------------------
+def loadContextState(context):
+    variables = context['variables']
+    context['plan_cache'] = loadPlanCache(variables['plan_cache_file'], new_run=False)
+    context['quarantine'] = loadQuarantine(variables['quarantine_file'])
+    context['retries'] = loadRetries(variables['retries_file'])
+    context['manifest'] = loadManifest(variables['manifest_file'], context['acceptedFieldList'])
+    context['source_files'] = loadSourceFiles(variables['source_files_table'])
+
+
+# ------------------------------------------------
+# adds a workbook to the run report and the manifest, and quarantines it by its content hash if it failed
+# or takes it off the quarantine list once it loads. a workbook that failed because of the share or the
+# geodatabase isn't quarantined, it is tried again up to max_retries times
+# ------------------------------------------------
+def recordBatchOutcome(context, batch):
+    quarantine = context['quarantine']
+    retries = context['retries']
+    workbook = {'xlsx': batch['xlsx'], 'error': batch['error'], 'retry': batch['retry'],
+                'skipped': batch['skipped']}
+    workbook.update(batch['stats'])
+    context['report']['workbooks'].append(workbook)
+    # the manifest holds the workbooks whose rows are in the output table. a workbook that fails keeps the
+    # rows it had, so its entry is left as it was
+    if batch['error'] is None:
+        context['manifest']['files'][batch['xlsx']] = {'source_id': batch['source_id'], 'hash': batch['file_hash'],
+                                                       'rows': batch['checksum'][0],
+                                                       'checksum': '{0:016x}'.format(batch['checksum'][1]),
+                                                       # rows without a location aren't in the feature class
+                                                       'points': batch['point_checksum'][0],
+                                                       'point_checksum': '{0:016x}'.format(
+                                                           batch['point_checksum'][1])}
+    if batch['skipped']:
+        return
+    if batch['retry']:
+        # a workbook that couldn't be hashed never got off the share, it is always tried again
+        tries = retries.get(batch['file_hash'], 0) + 1
+        if batch['file_hash'] is None or tries < context['variables']['max_retries']:
+            if batch['file_hash'] is not None:
+                retries[batch['file_hash']] = tries
+            logger.info('%s was rolled back and will be tried again: %s', batch['xlsx'], batch['error'])
+            return
+        logger.info('%s has failed %s times, it is quarantined instead of being tried again', batch['xlsx'], tries)
+        batch['retry'] = workbook['retry'] = False
+    retries.pop(batch['file_hash'], None)
+    if batch['error'] is not None:
+        logger.info('%s was rolled back and quarantined: %s', batch['xlsx'], batch['error'])
+        # a workbook that couldn't be hashed is tried again next time
+        if batch['file_hash'] is not None:
+            quarantine[batch['file_hash']] = {'xlsx': batch['xlsx'], 'reason': batch['error'],
+                                              'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        return
+    for file_hash in [file_hash for file_hash, entry in quarantine.items() if entry['xlsx'] == batch['xlsx']]:
+        logger.info('%s loaded, taking it off the quarantine list', batch['xlsx'])
+        del quarantine[file_hash]
+
+
+# ------------------------------------------------
+# works out the run report; every workbook, the totals, the time in each stage and the change in the
+# totals since the last run
+# ------------------------------------------------
+def buildRunReport(context, previous):
+    report = context['report']
+    finished = datetime.datetime.now()
+    seconds = (finished - report['started']).total_seconds()
+    workbooks = report['workbooks']
+    totals = {'workbooks': len(workbooks),
+              'loaded': len([w for w in workbooks if w['error'] is None]),
+              'quarantined': len([w for w in workbooks if w['error'] is not None and not w['skipped']
+                                  and not w['retry']]),
+              'retry': len([w for w in workbooks if w['retry']]),
+              'skipped': len([w for w in workbooks if w['skipped']]),
+              'seconds': round(seconds, 3)}
+    for key in ['rows_read', 'rows_written', 'coerced', 'rejected', 'location_defaults', 'location_nulls',
+                'location_imputed', 'transformed', 'off_centreline', 'cached']:
+        totals[key] = sum(w[key] for w in workbooks)
+    totals['rows_per_second'] = round(totals['rows_written'] / seconds, 1) if seconds else 0
+
+    stages = []
+    for stage in ['readStage'] + [stage.__name__ for stage in context['stages']]:
+        stage_seconds = report['stage_seconds'].get(stage, 0.0)
+        stages.append({'stage': stage, 'seconds': round(stage_seconds, 3),
+                       'rows_per_second': round(totals['rows_read'] / stage_seconds, 1) if stage_seconds else 0})
+
+    run_report = {'started': report['started'].strftime('%Y-%m-%d %H:%M:%S'),
+                  'finished': finished.strftime('%Y-%m-%d %H:%M:%S'),
+                  'workbooks': workbooks, 'stages': stages, 'totals': totals,
+                  'previous': None, 'change': {}}
+    if previous is not None:
+        run_report['previous'] = {'finished': previous['finished'], 'totals': previous['totals']}
+        run_report['change'] = dict((key, round(value - previous['totals'][key], 3))
+                                    for key, value in totals.items() if key in previous['totals'])
+    return run_report
+
+
+# ------------------------------------------------
+# writes the run report as json, and as a html page that can be opened from the share
+# ------------------------------------------------
+def writeRunReport(variables, context):
+    previous = None
+    if os.path.isfile(variables['report_file']):
+        try:
+            with open(variables['report_file'], 'r') as f:
+                previous = json.load(f)
+        except ValueError:
+            logger.info('last run report %s could not be read, nothing to compare to', variables['report_file'])
+    run_report = buildRunReport(context, previous)
+    with open(variables['report_file'], 'w') as f:
+        json.dump(run_report, f, indent=2, sort_keys=True)
+    with open(variables['report_html_file'], 'wb') as f:
+        f.write(returnReportHtml(run_report).encode('utf-8'))
+    totals = run_report['totals']
+    logger.info('%s of %s rows written from %s workbooks in %s seconds (%s rows/sec), report written to %s',
+                totals['rows_written'], totals['rows_read'], totals['workbooks'], totals['seconds'],
+                totals['rows_per_second'], variables['report_html_file'])
+    return run_report
+
+
+# ------------------------------------------------
+# lays the run report out as a html page; totals against the last run, stage times and every workbook
+# ------------------------------------------------
+def returnReportHtml(run_report):
+    def escape(value):
+        text = u'{0}'.format('' if value is None else value)
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+    def table(headers, rows, failed=None):
+        lines = ['<table>', '<tr>' + ''.join('<th>' + escape(header) + '</th>' for header in headers) + '</tr>']
+        for i, row in enumerate(rows):
+            # rows of workbooks that failed are highlighted
+            tr = '<tr class="failed">' if failed and failed[i] else '<tr>'
+            lines.append(tr + ''.join('<td>' + escape(value) + '</td>' for value in row) + '</tr>')
+        lines.append('</table>')
+        return '\n'.join(lines)
+
+    totals = run_report['totals']
+    previous = run_report['previous']['totals'] if run_report['previous'] else {}
+    workbook_keys = ['xlsx', 'rows_read', 'rows_written', 'coerced', 'rejected', 'location_defaults', 'location_nulls',
+                     'location_imputed', 'transformed', 'off_centreline', 'cached', 'error']
+    html = ['<!DOCTYPE html>', '<html>', '<head>', '<meta charset="utf-8">',
+            '<title>CCI merge run report</title>',
+            '<style>body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:1em}'
+            'th,td{border:1px solid #999;padding:2px 6px;text-align:left}tr.failed{background:#fdd}</style>',
+            '</head>', '<body>',
+            '<h1>CCI merge run report</h1>',
+            '<p>' + escape(run_report['started']) + ' to ' + escape(run_report['finished']) + '</p>',
+            '<h2>Totals</h2>',
+            table(['', 'this run', 'last run', 'change'],
+                  [[key, value, previous.get(key), run_report['change'].get(key)]
+                   for key, value in sorted(totals.items())]),
+            '<h2>Stages</h2>',
+            table(['stage', 'seconds', 'rows/sec'],
+                  [[stage['stage'], stage['seconds'], stage['rows_per_second']] for stage in run_report['stages']]),
+            '<h2>Workbooks</h2>',
+            table(workbook_keys, [[workbook[key] for key in workbook_keys] for workbook in run_report['workbooks']],
+                  [workbook['error'] is not None for workbook in run_report['workbooks']]),
+            '</body>', '</html>', '']
+    return '\n'.join(html)
+
+
+# ------------------------------------------------
+# loads workbooks again; the workbooks are run through the pipeline and the rows and rejects already
+# loaded from them are deleted by their source file id in the edit session the new ones are written in.
+# a workbook that can't be read or written keeps its old rows. returns the batches as they finish
+# ------------------------------------------------
+def reloadWorkbooks(context, xlsx_list):
+    context['replace_rows'] = True
+    return runPipeline(xlsx_list, context)
+
+
+# ------------------------------------------------
+# brings the output table up to date with the input folder; the rows and rejects of removed workbooks are
+# deleted and ready workbooks, the changed workbooks and their snapshot, are loaded again. the ingest state
+# is updated
+# ------------------------------------------------
+def applyFolderChanges(context, ingested, ready, removed):
+    variables = context['variables']
+    if removed:
+        logger.info('workbooks removed from the input folder: %s', ', '.join(removed))
+        source_ids = [context['source_files'].pop(xlsx)['id'] for xlsx in removed
+                      if xlsx in context['source_files']]
+        for in_table in [variables['output_table'], variables['output_fc'], variables['rejects_table'],
+                         variables['source_files_table']]:
+            deleteSourceRows(in_table, source_ids)
+        for xlsx in removed:
+            del ingested[xlsx]
+            context['manifest']['files'].pop(xlsx, None)
+
+    if ready:
+        logger.info('loading changed workbooks: %s', ', '.join(sorted(ready)))
+        # a quarantined workbook is recorded at its current snapshot so it isn't retried until it changes again,
+        # one that failed because of the share or the geodatabase is left out so it is loaded again
+        for batch in reloadWorkbooks(context, sorted(ready)):
+            recordBatchOutcome(context, batch)
+            if not batch['retry']:
+                ingested[batch['xlsx']] = ready[batch['xlsx']]
+
+
+# ------------------------------------------------
+# watches the input folder and loads workbooks as they are added, changed or removed. the folder is
+# polled so it works on the network share, and a workbook is only loaded once it has stopped changing
+# for settle_seconds so a burst of saves is loaded once
+# ------------------------------------------------
+def watchFolder(variables, context, poll_seconds, settle_seconds):
+    input_folder = variables['input_folder']
+    ingested = loadIngestState(variables['ingest_state_file'])
+    pending = {}
+    logger.info('watching %s for changes every %s seconds...', input_folder, poll_seconds)
+
+    while True:
+        snapshot = folderSnapshot(input_folder)
+        now = time.time()
+        for xlsx, signature in snapshot.items():
+            if ingested.get(xlsx) == signature:
+                pending.pop(xlsx, None)
+            elif xlsx not in pending or pending[xlsx][0] != signature:
+                # new or changed since the last poll, restart the wait
+                pending[xlsx] = [signature, now]
+        ready = dict((xlsx, signature) for xlsx, (signature, seen) in pending.items() if now - seen >= settle_seconds)
+        removed = sorted(xlsx for xlsx in ingested if xlsx not in snapshot)
+
+        # the lock is only held while changes are loaded, so a scheduled merge can run between them
+        if removed or ready:
+            lock = acquireRunLock(variables, 'watch')
+            if lock is None:
+                logger.info('another run holds the lock, the changes are left for the next poll')
+            else:
+                context['lock'] = lock
+                try:
+                    # a scheduled merge may have run since the last poll, so the state is read again now the lock
+                    # is held and workbooks it has already loaded are left out
+                    ingested = loadIngestState(variables['ingest_state_file'])
+                    loadContextState(context)
+                    ready = dict((xlsx, signature) for xlsx, signature in ready.items()
+                                 if ingested.get(xlsx) != signature)
+                    removed = [xlsx for xlsx in removed if xlsx in ingested]
+                    for xlsx in ready:
+                        pending.pop(xlsx)
+                    try:
+                        applyFolderChanges(context, ingested, ready, removed)
+                    finally:
+                        if runLockHeld(context):
+                            saveIngestState(variables['ingest_state_file'], ingested)
+                            saveContextState(context)
+                finally:
+                    context['lock'] = None
+                    releaseRunLock(lock)
+
+        time.sleep(poll_seconds)
+
+
+# ------------------------------------------------
+# defines the paths and settings used by the script, worked out from the config
+# ------------------------------------------------
+def returnVariables(workspace, config):
+    # with a scratch folder the geodatabase, state files and exports all go there so a trial run leaves the
+    # workspace's alone, only the input folder and the log stay in the workspace
+    gdb_folder = config['scratch_folder'] or workspace
+    output_gdb = gdb_folder + config['gdb_name'] + '/'
+    output_name = config['output_name']
+    cache_folder = gdb_folder + config['cache_folder']
+    variables = {
+        'workspace': workspace,
+        'gdb_folder': gdb_folder,
+        'output_gdb': output_gdb,
+        'output_table': output_gdb + config['output_table_name'],
+        'output_name': output_name,
+        'output_fc': output_gdb + output_name,
+        'output_temp_table': output_gdb + "temp",
+        'rejects_name': config['rejects_name'],
+        'rejects_table': output_gdb + config['rejects_name'],
+        'source_files_name': config['source_files_name'],
+        'source_files_table': output_gdb + config['source_files_name'],
+        'input_folder': workspace + config['input_folder'],
+        'cache_folder': cache_folder,
+        # header layouts and their column plans are remembered between runs,
+        # layouts not seen for this many runs are removed from the cache
+        'plan_cache_file': cache_folder + 'column_plans.json',
+        'plan_cache_max_idle_runs': config['plan_cache_max_idle_runs'],
+        # the columns of workbooks already read, by content hash. the least recently used are removed once
+        # the cache is over workbook_cache_bytes, 0 turns the cache off
+        'workbook_cache_folder': cache_folder + 'workbooks/',
+        'workbook_cache_bytes': config['workbook_cache_mb'] * 1024 * 1024,
+        # the workbooks loaded into the output table, used by watch mode to find changed workbooks
+        'ingest_state_file': cache_folder + 'ingest_state.json',
+        # workbooks that failed, skipped by their content hash until they change
+        'quarantine_file': cache_folder + 'quarantine.json',
+        # the times each workbook has been tried again by its content hash, it is quarantined after max_retries
+        'retries_file': cache_folder + 'retries.json',
+        'max_retries': config['max_retries'],
+        # the run report, the previous one is read back to compare against before it is replaced
+        'report_file': cache_folder + 'run_report.json',
+        'report_html_file': cache_folder + 'run_report.html',
+        # the row count and checksum of every workbook in the output table, checked by verify
+        'manifest_file': cache_folder + 'manifest.json',
+        'src_xlsx': config['src_xlsx'],
+        # the point rows get when their location can't be read, and the coordinate system of the points
+        'default_location': config['default_location'],
+        'spatial_reference': config['spatial_reference'],
+        # what rows get when their location can't be read; the default location, no point, or a point placed
+        # from their KP on the pipeline named in kp_pipeline_field
+        'location_fallback': config['location_fallback'],
+        'kp_pipeline_field': config['kp_pipeline_field'],
+        'target_crs': ([name for name, datum in returnDatums().items()
+                        if datum['code'] == config['spatial_reference']] or [None])[0],
+        # the datum locations are written in, and the MGA zone of locations given as easting/northing
+        'source_crs': config['source_crs'],
+        'mga_zone': config['mga_zone'],
+        # the pipeline centrelines points are snapped to, the fields with each pipeline's name and KP at its
+        # start, and how far in metres a point can be from a pipeline before it is flagged
+        'centreline_fc': config['centreline_fc'],
+        'centreline_name_field': config['centreline_name_field'],
+        'centreline_kp_field': config['centreline_kp_field'],
+        'centreline_max_offset': config['centreline_max_offset'],
+        # workbook files read ahead of the read stage
+        'workers': config['workers'],
+        # the lease file held while a run writes to the geodatabase, how long it lasts without being renewed
+        # and how long a run waits for another to finish before giving up
+        'lock_file': gdb_folder + config['gdb_name'] + '.lock',
+        'lock_lease_seconds': config['lock_lease_seconds'],
+        'lock_wait_seconds': config['lock_wait_seconds'],
+        # how often watch mode checks the input folder, and how long a workbook must be unchanged before loading
+        'poll_seconds': config['poll_seconds'],
+        'settle_seconds': config['settle_seconds'],
+        # rows written to the output table in each edit session, and the sizes and number of rows
+        # the bench command tries when picking it
+        'write_batch_size': config['write_batch_size'],
+        # files a full merge also writes the rows to; csv, geojson or parquet
+        'export_sinks': config['export_sinks'],
+        'export_folder': gdb_folder + config['export_folder'],
+        'bench_batch_sizes': config['bench_batch_sizes'],
+        'bench_rows': config['bench_rows'],
+    }
+    return variables
+
+
+# ------------------------------------------------
+# every setting the config can hold, with its type and default. the defaults are the prod settings
+# ------------------------------------------------
+def returnConfigOptions():
+    ### defining option, type and default
+    DIC_config_options = {
+        'workspace': ['text', '//pipelinetrust.com.au/apps/GIS/Projects/CCI_Reporting/'],
+        # folders and files below the workspace
+        'input_folder': ['text', '_in/'],
+        'cache_folder': ['text', '_py/'],
+        'log_file': ['text', 'runtime.log'],
+        'gdb_name': ['text', 'data.gdb'],
+        # a folder to write the geodatabase to instead of the workspace, for trial runs
+        'scratch_folder': ['text', ''],
+        'output_table_name': ['text', 'CCI'],
+        'output_name': ['text', 'Corridor_Condition_Reports'],
+        'rejects_name': ['text', 'CCI_Rejects'],
+        'source_files_name': ['text', 'CCI_Source_Files'],
+        'src_xlsx': ['text', 'http://thehub.apa.com.au/workareap/ID/IPP/Corridor%20Condition%20Reports/Field%20Services'],
+        'default_location': ['text', '-26.006099,133.952746'],
+        'location_fallback': ['text', 'null'],
+        'kp_pipeline_field': ['text', 'Pipeline_Patrol_Program'],
+        'spatial_reference': ['int', 4283],
+        'source_crs': ['text', 'GDA94'],
+        'mga_zone': ['int', 0],
+        'centreline_fc': ['text', ''],
+        'centreline_name_field': ['text', ''],
+        'centreline_kp_field': ['text', ''],
+        'centreline_max_offset': ['float', 500.0],
+        'workers': ['int', 1],
+        # not yet confirmed with a bench run against the geodatabase on the share, until then 5000 is kept
+        # as the middle of bench_batch_sizes
+        'write_batch_size': ['int', 5000],
+        'bench_batch_sizes': ['int list', [100, 500, 1000, 5000, 10000, 50000]],
+        'bench_rows': ['int', 50000],
+        'plan_cache_max_idle_runs': ['int', 10],
+        'max_retries': ['int', 3],
+        'workbook_cache_mb': ['int', 500],
+        'lock_lease_seconds': ['float', 300.0],
+        'lock_wait_seconds': ['float', 0.0],
+        'poll_seconds': ['float', 5.0],
+        'settle_seconds': ['float', 10.0],
+        'export_sinks': ['text list', []],
+        'export_folder': ['text', 'exports/'],
+    }
+    return DIC_config_options
+
+
+# ------------------------------------------------
+# settings each profile changes from the defaults. a config file can change these or add its own
+# ------------------------------------------------
+def returnConfigProfiles():
+    DIC_config_profiles = {
+        'prod': {},
+        # a scratch copy of the workspace in the folder the script is run from
+        'local': {'workspace': './'},
+        # a scratch workspace for timing runs, with more rows for the write benchmark
+        'bench': {'workspace': './', 'workers': 4, 'bench_rows': 200000},
+    }
+    return DIC_config_profiles
+
+
+# ------------------------------------------------
+# turns a config value into the option's type, values from the command line are text and are split
+# and converted here too. raises ValueError if it can't be converted
+# ------------------------------------------------
+def convertConfigValue(name, option_type, value):
+    try:
+        if option_type == 'int list' or option_type == 'text list':
+            if not isinstance(value, list):
+                value = [part.strip() for part in u'{0}'.format(value).split(',') if part.strip()]
+            return [int(part) if option_type == 'int list' else u'{0}'.format(part) for part in value]
+        elif option_type == 'int':
+            if isinstance(value, float) and value != int(value):
+                raise ValueError(value)
+            return int(value)
+        elif option_type == 'float':
+            return float(value)
+        return u'{0}'.format(value)
+    except (TypeError, ValueError):
+        raise ValueError('config option {0} must be {1}, not {2!r}'.format(name, option_type, value))
+
+
+# ------------------------------------------------
+# checks the config values make sense together, raises ValueError listing every problem
+# ------------------------------------------------
+def validateConfig(config):
+    problems = []
+    for name in ['workers', 'write_batch_size', 'bench_rows', 'plan_cache_max_idle_runs', 'max_retries',
+                 'spatial_reference']:
+        if config[name] < 1:
+            problems.append('{0} must be at least 1'.format(name))
+    if config['workbook_cache_mb'] < 0:
+        problems.append('workbook_cache_mb can not be negative')
+    if not config['bench_batch_sizes'] or min(config['bench_batch_sizes']) < 1:
+        problems.append('bench_batch_sizes must be a list of sizes of at least 1')
+    if config['lock_lease_seconds'] <= 0:
+        problems.append('lock_lease_seconds must be more than 0')
+    for name in ['poll_seconds', 'settle_seconds', 'lock_wait_seconds']:
+        if config[name] < 0:
+            problems.append('{0} can not be negative'.format(name))
+    for sink_type in config['export_sinks']:
+        if sink_type not in ('csv', 'geojson', 'parquet'):
+            problems.append('export_sinks can be csv, geojson or parquet, not {0}'.format(sink_type))
+    datums = returnDatums()
+    if config['spatial_reference'] not in [datum['code'] for datum in datums.values()]:
+        problems.append('spatial_reference must be one of {0}'.format(
+            sorted(datum['code'] for datum in datums.values())))
+    if config['source_crs'] not in datums:
+        problems.append('source_crs must be one of {0}'.format(sorted(datums)))
+    if config['mga_zone'] != 0 and not 46 <= config['mga_zone'] <= 59:
+        problems.append('mga_zone must be 0 or an MGA zone from 46 to 59')
+    if config['centreline_max_offset'] <= 0:
+        problems.append('centreline_max_offset must be more than 0')
+    if config['location_fallback'] not in ('default', 'null', 'kp'):
+        problems.append('location_fallback can be default, null or kp, not {0}'.format(config['location_fallback']))
+    if config['location_fallback'] == 'kp' and not config['centreline_fc']:
+        problems.append('location_fallback kp needs centreline_fc to place rows on')
+    if config['kp_pipeline_field'] not in returnAcceptedFieldList():
+        problems.append('kp_pipeline_field must be an accepted field')
+    parts = config['default_location'].split(',')
+    try:
+        latitude, longitude = [float(part) for part in parts]
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            problems.append('default_location is not a latitude,longitude')
+    except ValueError:
+        problems.append('default_location must be latitude,longitude')
+    if problems:
+        raise ValueError('config problems: ' + '; '.join(problems))
+
+
+# ------------------------------------------------
+# builds the config once; the defaults, then the config file, then the profile and then the overrides
+# from the command line. folders always end in a slash. raises ValueError for unknown options, values
+# of the wrong type or values that don't make sense
+# ------------------------------------------------
+def loadConfig(config_file=None, profile='prod', overrides=None):
+    options = returnConfigOptions()
+    profiles = returnConfigProfiles()
+    layers = []
+    if config_file is not None:
+        with open(config_file, 'r') as f:
+            file_config = json.load(f)
+        for name, values in file_config.pop('profiles', {}).items():
+            profiles[name] = dict(profiles.get(name, {}))
+            profiles[name].update(values)
+        layers.append(('config file', file_config))
+    if profile not in profiles:
+        raise ValueError('unknown config profile {0}, the profiles are: {1}'.format(
+            profile, ', '.join(sorted(profiles))))
+    layers.append(('profile ' + profile, profiles[profile]))
+    layers.append(('command line', overrides or {}))
+
+    config = dict((name, value[1]) for name, value in options.items())
+    for source, values in layers:
+        for name, value in values.items():
+            if name not in options:
+                raise ValueError('unknown config option {0} in the {1}'.format(name, source))
+            config[name] = convertConfigValue(name, options[name][0], value)
+    for name in ['workspace', 'input_folder', 'cache_folder', 'scratch_folder', 'export_folder']:
+        if config[name] and not config[name].endswith('/'):
+            config[name] += '/'
+    validateConfig(config)
+    config['profile'] = profile
+    return config
+
+
+# ------------------------------------------------
+# the command line; a subcommand for each job, all sharing the config options --config, --profile and
+# --set option=value. merge is run when no subcommand is given
+# ------------------------------------------------
+def returnArgumentParser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help='json config file')
+    common.add_argument('--profile', default='prod', help='config profile; prod, local, bench or one from the file')
+    common.add_argument('--set', action='append', default=[], metavar='OPTION=VALUE',
+                        help='change a config option, can be given more than once')
+
+    parser = argparse.ArgumentParser(description='merges the CCI spreadsheets into a geodatabase table '
+                                                 'and feature class')
+    subparsers = parser.add_subparsers(dest='command')
+    merge = subparsers.add_parser('merge', parents=[common], help='load the spreadsheets')
+    merge.add_argument('--incremental', action='store_true',
+                       help='only load workbooks added or changed since the last run, and remove deleted ones')
+    merge.add_argument('--watch', action='store_true', help='keep watching the input folder after the merge')
+    merge.add_argument('--workers', type=int, help='workbook files read ahead on worker threads')
+    merge.add_argument('--batch-size', type=int, help='rows written in each edit session')
+    merge.add_argument('--scratch', help='folder to write the geodatabase, state files and exports to instead of '
+                                         'the workspace')
+    merge.add_argument('--export', help='export files to write too, any of csv, geojson and parquet, comma separated')
+    plan = subparsers.add_parser('plan', parents=[common], help='show what a merge would do without writing')
+    plan.add_argument('--incremental', action='store_true', help='plan an incremental merge')
+    bench = subparsers.add_parser('bench', parents=[common], help='time writing synthetic rows with each batch size')
+    bench.add_argument('--locations', action='store_true', help='time the location parser instead')
+    subparsers.add_parser('report', parents=[common], help='show the last run report')
+    subparsers.add_parser('verify', parents=[common], help='check the output row counts and checksums '
+                                                            'against the manifest')
+    reload_parser = subparsers.add_parser('reload', parents=[common], help='load the given workbooks again')
+    reload_parser.add_argument('xlsx', nargs='+', help='workbook names in the input folder')
+    return parser
+
+
+# ------------------------------------------------
+# reads the command line into the subcommand arguments and the config they share. the merge options
+# are config overrides, so they are checked along with the rest of the config
+# ------------------------------------------------
+def returnArguments(argv):
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv = ['merge'] + list(argv)
+    parser = returnArgumentParser()
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for setting in args.set:
+        name, separator, value = setting.partition('=')
+        if not separator:
+            parser.error('--set needs option=value, not ' + setting)
+        overrides[name] = value
+    for name, option in [('workers', 'workers'), ('batch_size', 'write_batch_size'), ('scratch', 'scratch_folder'),
+                         ('export', 'export_sinks')]:
+        if getattr(args, name, None) is not None:
+            overrides[option] = getattr(args, name)
+    try:
+        config = loadConfig(args.config, args.profile, overrides)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+    return args, config
+
+
+# ------------------------------------------------
+# main function. with watch set, the folder is watched for changed spreadsheets after the full merge
+# ------------------------------------------------
+def main(config, watch=False):
+    # setup logger
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+
+    # testing if try:except works when you wrap everything in the try 
+    try:
+        ### define global variables
+        # ------------------------------------------------
+        logger.info('Setting up environment & variables...\n')
+        workspace = environment(config)
+        logger.info('using the %s config profile, workspace %s', config['profile'], workspace)
+        variables = returnVariables(workspace, config)
+        output_gdb = variables['output_gdb']
+        output_table = variables['output_table']
+        input_folder = variables['input_folder']
+        src_xlsx = variables['src_xlsx']
+        # defines the starting location of the list for the islice for loop 
+        xlsx_start_pt = 0
+        # ------------------------------------------------
+
+
+    ##    logger.info('copying files from source location and moving to destination')
+    ##    copyFiles(src_xlsx, input_folder)
+
+        # renewFC deletes the geodatabase, so nothing else can be writing to it
+        lock = acquireRunLock(variables, 'merge')
+        if lock is None:
+            logger.info('another run is using %s, not merging', output_gdb)
+            return False
+        try:
+            logger.info('CHECKING IF THE FOLLOWING FEATURE CLASS EXISTS:\n%s', output_gdb + '\n')
+            renewFC(variables['gdb_folder'], output_gdb)
+
+            logger.info('creating rejects table...')
+            createRejectsTable(output_gdb, variables['rejects_name'])
+
+            logger.info('creating source files table...')
+            createSourceFilesTable(output_gdb, variables['source_files_name'])
+
+            logger.info('loading column plan cache...')
+            plan_cache = loadPlanCache(variables['plan_cache_file'])
+            context = createMergeContext(plan_cache, variables)
+            context['lock'] = lock
+            # the geodatabase is new so none of the workbooks in the manifest are in it any more
+            context['manifest']['files'] = {}
+
+            logger.info('creating CCI table and feature class...')
+            createOutputTables(variables, context['output_field_names'])
+            context['output_fields'] = fieldDescriptors(output_table)
+
+            # the snapshot is taken before loading so a workbook saved during the run is picked up by watch mode
+            snapshot = folderSnapshot(input_folder)
+
+            context['sinks'] = openExportSinks(variables, context['output_field_names'])
+
+            logger.info('CONVERSION FROM XLSX TO FILE GEODATABASE TABLE AND FEATURE CLASS...\n\n')
+            merged = False
+            try:
+                excelToTable(input_folder, xlsx_start_pt, context)
+                merged = True
+            finally:
+                # once the lock is lost the state files belong to the run that took it over
+                held = runLockHeld(context)
+                closeExportSinks(context, publish=merged and held)
+                if held:
+                    saveContextState(context)
+                    writeRunReport(variables, context)
+            if not held:
+                raise RuntimeError('the run lock {0} was lost, the state files were not saved'.format(lock['file']))
+
+            # workbooks to try again are left out of the ingest state, so an incremental merge loads them
+            for workbook in context['report']['workbooks']:
+                if workbook['retry']:
+                    snapshot.pop(workbook['xlsx'], None)
+            saveIngestState(variables['ingest_state_file'], snapshot)
+        finally:
+            releaseRunLock(lock)
+
+        if watch:
+            logger.info('WATCHING FOR CHANGED SPREADSHEETS...\n')
+            watchFolder(variables, context, variables['poll_seconds'], variables['settle_seconds'])
+        
+        logger.info('SCRIPT FINISHED')
+    except WindowsError as e:
+        logger.info("Windows Error")
+        logger.info('Exception:\n %s' % repr(e))
+        sys.exit()
     except IOError as e:
         logger.info("Error: IOError")
         logger.info("Exception:\n %s" % repr(e))
@@ -647,5 +3870,243 @@ def main():
         logger.info("Exception:\n %s" % repr(e))
 
 
+# ------------------------------------------------
+# runs the write batch size benchmark
+# ------------------------------------------------
+def benchWrite(config):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    variables = returnVariables(environment(config), config)
+    fieldNames = returnOutputFields(returnAcceptedFieldList())
+    logger.info('BENCHMARKING WRITE BATCH SIZES...\n')
+    benchmarkBatchSizes(variables, fieldNames, variables['bench_batch_sizes'], variables['bench_rows'])
+
+
+# ------------------------------------------------
+# runs the location parser benchmark, nothing is read or written
+# ------------------------------------------------
+def benchLocations(config):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    logger.info('BENCHMARKING THE LOCATION PARSER...\n')
+    benchmarkLocationParser(config['bench_rows'])
+
+
+# ------------------------------------------------
+# loads the given workbooks again into the existing output table, leaving the rows of every other workbook
+# ------------------------------------------------
+def reloadSpreadsheets(config, xlsx_list):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    variables = returnVariables(environment(config), config)
+    lock = acquireRunLock(variables, 'reload')
+    if lock is None:
+        logger.info('another run is using %s, not reloading', variables['output_gdb'])
+        return False
+    try:
+        plan_cache = loadPlanCache(variables['plan_cache_file'])
+        context = createMergeContext(plan_cache, variables)
+        context['lock'] = lock
+        context['output_fields'] = fieldDescriptors(variables['output_table'])
+        context['source_files'] = loadSourceFiles(variables['source_files_table'])
+        snapshot = folderSnapshot(variables['input_folder'])
+        ingested = loadIngestState(variables['ingest_state_file'])
+
+        logger.info('RELOADING SPREADSHEETS: %s\n', ', '.join(xlsx_list))
+        try:
+            for batch in reloadWorkbooks(context, xlsx_list):
+                recordBatchOutcome(context, batch)
+                if batch['error'] is None and batch['xlsx'] in snapshot:
+                    ingested[batch['xlsx']] = snapshot[batch['xlsx']]
+        finally:
+            if runLockHeld(context):
+                saveContextState(context)
+                saveIngestState(variables['ingest_state_file'], ingested)
+    finally:
+        releaseRunLock(lock)
+
+
+# ------------------------------------------------
+# loads only the workbooks added or changed since the last run and removes the rows of deleted ones,
+# using the ingest state. runs a full merge when there is no output table yet
+# ------------------------------------------------
+def incrementalMerge(config, watch=False):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    variables = returnVariables(environment(config), config)
+    if not arcpy.Exists(variables['output_table']):
+        logger.info('no output table at %s yet, running a full merge', variables['output_table'])
+        return main(config, watch)
+
+    # the state files are read once the lock is held, so they aren't changed by another run part way
+    lock = acquireRunLock(variables, 'incremental merge')
+    if lock is None:
+        logger.info('another run is using %s, not merging', variables['output_gdb'])
+        return False
+    try:
+        plan_cache = loadPlanCache(variables['plan_cache_file'])
+        context = createMergeContext(plan_cache, variables)
+        context['lock'] = lock
+        context['output_fields'] = fieldDescriptors(variables['output_table'])
+        context['source_files'] = loadSourceFiles(variables['source_files_table'])
+        ingested = loadIngestState(variables['ingest_state_file'])
+        snapshot = folderSnapshot(variables['input_folder'])
+        ready = dict((xlsx, signature) for xlsx, signature in snapshot.items() if ingested.get(xlsx) != signature)
+        removed = sorted(xlsx for xlsx in ingested if xlsx not in snapshot)
+
+        logger.info('INCREMENTAL MERGE: %s workbooks to load, %s removed\n', len(ready), len(removed))
+        try:
+            applyFolderChanges(context, ingested, ready, removed)
+        finally:
+            if runLockHeld(context):
+                saveContextState(context)
+                saveIngestState(variables['ingest_state_file'], ingested)
+                writeRunReport(variables, context)
+        context['lock'] = None
+    finally:
+        releaseRunLock(lock)
+
+    if watch:
+        logger.info('WATCHING FOR CHANGED SPREADSHEETS...\n')
+        watchFolder(variables, context, variables['poll_seconds'], variables['settle_seconds'])
+
+
+# ------------------------------------------------
+# dry run; lists the workbooks a merge would load and how each would be read, without writing anything
+# ------------------------------------------------
+def planMerge(config, incremental=False):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    variables = returnVariables(environment(config), config)
+    context = createMergeContext(loadPlanCache(variables['plan_cache_file']), variables)
+    xlsx_list = listWorkbooks(variables['input_folder'])
+    if incremental:
+        ingested = loadIngestState(variables['ingest_state_file'])
+        snapshot = folderSnapshot(variables['input_folder'])
+        xlsx_list = sorted(xlsx for xlsx, signature in snapshot.items() if ingested.get(xlsx) != signature)
+        for xlsx in sorted(xlsx for xlsx in ingested if xlsx not in snapshot):
+            logger.info('PLAN %s: removed, its rows would be deleted', xlsx)
+
+    counts = {}
+    for xlsx, contents, error in prefetchWorkbooks(xlsx_list, variables['input_folder'], variables['workers']):
+        try:
+            if error is not None:
+                raise error
+            entry = context['quarantine'].get(hashlib.sha1(contents).hexdigest())
+            if entry is not None:
+                category = 'quarantined'
+                action = 'skipped, quarantined on {0}: {1}'.format(entry['date'], entry['reason'])
+            else:
+                book = xlrd.open_workbook(file_contents=contents, on_demand=True)
+                try:
+                    match = sniffTemplate(book, context['templates'], context['alias_index'])
+                    if match is None:
+                        category = 'ExcelToTable'
+                        action = 'read through ExcelToTable from the {0} sheet'.format(context['sheet'])
+                    else:
+                        template, sheet_name, headers = match
+                        category = template['name'] + ' template'
+                        action = 'read with the {0} template from the {1} sheet, about {2} rows'.format(
+                            template['name'], sheet_name,
+                            max(book.sheet_by_name(sheet_name).nrows - template['header_row'] - 1, 0))
+                finally:
+                    book.release_resources()
+        except Exception as e:
+            category = 'failing'
+            action = 'would fail and be quarantined: {0}'.format(repr(e))
+        logger.info('PLAN %s: %s', xlsx, action)
+        counts[category] = counts.get(category, 0) + 1
+    logger.info('PLAN %s workbooks: %s', len(xlsx_list), formatCounts(counts))
+
+
+# ------------------------------------------------
+# shows the last run report
+# ------------------------------------------------
+def showReport(config):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    variables = returnVariables(environment(config), config)
+    if not os.path.isfile(variables['report_file']):
+        logger.info('there is no run report at %s yet', variables['report_file'])
+        return
+    with open(variables['report_file'], 'r') as f:
+        run_report = json.load(f)
+    logger.info('run from %s to %s', run_report['started'], run_report['finished'])
+    for key, value in sorted(run_report['totals'].items()):
+        logger.info('%s: %s (change since the run before: %s)', key, value, run_report['change'].get(key))
+    for stage in run_report['stages']:
+        logger.info('%s: %s seconds, %s rows/sec', stage['stage'], stage['seconds'], stage['rows_per_second'])
+    for workbook in run_report['workbooks']:
+        if workbook['error'] is not None:
+            logger.info('%s failed: %s', workbook['xlsx'], workbook['error'])
+    logger.info('the full report is at %s', variables['report_html_file'])
+
+
+# ------------------------------------------------
+# the row count and checksum of the rows of each source file id in a table or feature class, in one pass
+# ------------------------------------------------
+def sourceChecksums(in_table, fields):
+    checksums = {}
+    with arcpy.da.SearchCursor(in_table, ['Source_File_ID'] + fields) as cursor:
+        for row in cursor:
+            checksum = checksumRows([row[1:]])
+            if row[0] in checksums:
+                checksums[row[0]] = combineChecksums([checksums[row[0]], checksum])
+            else:
+                checksums[row[0]] = checksum
+    return checksums
+
+
+# ------------------------------------------------
+# checks the output table and feature class hold the rows in the manifest for every workbook, by row count
+# and checksum, and that every workbook in the input folder was loaded or quarantined. the output is read
+# in one cursor pass each. returns True when everything matches
+# ------------------------------------------------
+def verifyOutput(config):
+    init_logger_singleton(config['workspace'] + config['cache_folder'] + config['log_file'])
+    variables = returnVariables(environment(config), config)
+    manifest = loadManifest(variables['manifest_file'], returnAcceptedFieldList())
+    quarantined = set(entry['xlsx'] for entry in loadQuarantine(variables['quarantine_file']).values())
+
+    problems = 0
+    totals = {}
+    # the feature class only has the rows with a location
+    for in_table, rows_key, checksum_key in [[variables['output_table'], 'rows', 'checksum'],
+                                             [variables['output_fc'], 'points', 'point_checksum']]:
+        checksums = sourceChecksums(in_table, manifest['fields'])
+        totals[in_table] = combineChecksums(list(checksums.values()))
+        expected = combineChecksums([[entry[rows_key], int(entry[checksum_key], 16)]
+                                     for entry in manifest['files'].values()])
+        logger.info('VERIFY %s: %s rows with checksum %016x, the manifest has %s rows with %016x',
+                    in_table, totals[in_table][0], totals[in_table][1], expected[0], expected[1])
+        for xlsx, entry in sorted(manifest['files'].items()):
+            count, total = checksums.pop(entry['source_id'], [0, 0])
+            if count != entry[rows_key] or '{0:016x}'.format(total) != entry[checksum_key]:
+                problems += 1
+                logger.info('VERIFY %s in %s: %s rows with checksum %016x, the manifest has %s rows with %s',
+                            xlsx, in_table, count, total, entry[rows_key], entry[checksum_key])
+        for source_id in checksums:
+            problems += 1
+            logger.info('VERIFY %s has rows from source file id %s, which is not in the manifest', in_table, source_id)
+    for xlsx in listWorkbooks(variables['input_folder']):
+        if xlsx not in manifest['files'] and xlsx not in quarantined:
+            problems += 1
+            logger.info('VERIFY %s is in the input folder but has not been loaded', xlsx)
+
+    logger.info('VERIFY %s workbooks checked, %s problems found', len(manifest['files']), problems)
+    return problems == 0
+
+
 if __name__ == '__main__':    
-    main()
+    args, config = returnArguments(sys.argv[1:])
+    # runs that couldn't get the run lock exit with 1, so a scheduler can see they didn't run
+    if args.command == 'merge' and args.incremental:
+        sys.exit(1 if incrementalMerge(config, watch=args.watch) is False else 0)
+    elif args.command == 'merge':
+        sys.exit(1 if main(config, watch=args.watch) is False else 0)
+    elif args.command == 'plan':
+        planMerge(config, incremental=args.incremental)
+    elif args.command == 'bench' and args.locations:
+        benchLocations(config)
+    elif args.command == 'bench':
+        benchWrite(config)
+    elif args.command == 'report':
+        showReport(config)
+    elif args.command == 'verify':
+        sys.exit(0 if verifyOutput(config) else 1)
+    elif args.command == 'reload':
+        sys.exit(1 if reloadSpreadsheets(config, args.xlsx) is False else 0)